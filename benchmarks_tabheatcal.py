@@ -0,0 +1,321 @@
+"""Benchmarks of the tabheatcal rendering stages on seeded synthetic data.
+
+Runs offline: every series is generated from a fixed seed, like demo() but
+reproducible. For each data size, density and palette it reports the best
+wall time and the peak traced memory of every rendering stage, then checks
+that all rendering paths produce the same HTML and that it matches the
+golden digests below, and that a RenderCache never serves a page that was
+overwritten through one of its links.
+
+    python benchmarks_tabheatcal.py            # full run
+    python benchmarks_tabheatcal.py --quick    # 1 and 5 years only
+    python benchmarks_tabheatcal.py --print-golden
+
+It also imports tabheatcal in fresh interpreters and fails when the import
+loads a module that should be lazy or gets slower than IMPORT_BUDGET_MS.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import tabheatcal as tabh
+
+YEARS = (1, 5, 20, 50)
+# share of days without a value
+DENSITIES = {"dense": 0.0, "sparse": 0.7}
+PALETTES = ("RdYlGn", "Spectral", "Spectral1", "Blues")
+MODES = {
+    "inline": {},
+    "css_classes": {"css_classes": True},
+    "json_payload": {"json_payload": True},
+}
+
+# modules "import tabheatcal" must not load; a small list input calendar
+# must not load numpy either
+LAZY_MODULES = ("numpy", "jinja2", "subprocess", "concurrent.futures", "asyncio")
+IMPORT_BUDGET_MS = 100
+IMPORT_PROBE = """
+import datetime, json, sys, time
+start = time.perf_counter()
+import tabheatcal
+import_ms = (time.perf_counter() - start) * 1000
+loaded = [name for name in %r if name in sys.modules]
+days = [datetime.date(2024, 1, 1) + datetime.timedelta(i) for i in range(90)]
+values = [float(i %% 7) for i in range(90)]
+tabheatcal.table_html(days, values, [str(value) for value in values])
+print(json.dumps([import_ms, loaded, "numpy" in sys.modules]))
+""" % (LAZY_MODULES,)
+
+# sha256 of table_html output for 5 years of data; the inline digests were
+# taken from the original per-cell implementation
+GOLDEN_YEARS = 5
+GOLDEN = {
+    ("dense", "RdYlGn", "inline"): "3d84fb6279df012f",
+    ("dense", "RdYlGn", "css_classes"): "2fc4842dfd4524a5",
+    ("dense", "RdYlGn", "json_payload"): "de2f95761f7fe041",
+    ("dense", "Spectral", "inline"): "3d493f99a2181265",
+    ("dense", "Spectral", "css_classes"): "f69cb2132f4d2d37",
+    ("dense", "Spectral", "json_payload"): "dc9e6836405890b1",
+    ("dense", "Spectral1", "inline"): "be68abe17067440a",
+    ("dense", "Spectral1", "css_classes"): "a4e6cbf44203f080",
+    ("dense", "Spectral1", "json_payload"): "396d11ab20d5106b",
+    ("dense", "Blues", "inline"): "22673eb360fa0276",
+    ("dense", "Blues", "css_classes"): "5e782473e3a41146",
+    ("dense", "Blues", "json_payload"): "9b40b94db6af3f02",
+    ("sparse", "RdYlGn", "inline"): "82763b9950701288",
+    ("sparse", "RdYlGn", "css_classes"): "8f22ff00abd63a6f",
+    ("sparse", "RdYlGn", "json_payload"): "2ce86a3f1fb9dd99",
+    ("sparse", "Spectral", "inline"): "64354278461200a5",
+    ("sparse", "Spectral", "css_classes"): "1e037696af6a8d85",
+    ("sparse", "Spectral", "json_payload"): "a730363d72d9d5e8",
+    ("sparse", "Spectral1", "inline"): "a78ea13a7b528da3",
+    ("sparse", "Spectral1", "css_classes"): "25f53d431d03b48b",
+    ("sparse", "Spectral1", "json_payload"): "e04743def534188c",
+    ("sparse", "Blues", "inline"): "8f0e46789c1a4691",
+    ("sparse", "Blues", "css_classes"): "dd3999317cfe2e0f",
+    ("sparse", "Blues", "json_payload"): "1421b51618f36649",
+}
+
+
+def synthetic_series(years, missing, seed=42):
+    """daily values from 2000-01-01 with outliers and NaN gaps"""
+    rng = np.random.default_rng(seed)
+    days = np.arange(
+        np.datetime64("2000-01-01"), np.datetime64(f"{2000 + years}-01-01")
+    )
+    values = rng.normal(0.2, 1.5, len(days))
+    outliers = rng.random(len(days)) < 0.02
+    values[outliers] *= 8
+    values[rng.random(len(days)) < 0.01] = np.nan
+    keep = rng.random(len(days)) >= missing
+    days, values = days[keep], values[keep]
+    labels = ["%.2f%%" % value for value in values.tolist()]
+    return days, values, labels
+
+
+def measure(func, repeat):
+    """best wall time of repeat calls and peak traced memory of one call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def stages(dates, values, labels, palette):
+    """(name, callable) of every rendering stage for one series"""
+    colors = tabh.get_palette(palette)
+    columns = tabh.as_columns(dates, values, labels)
+    color_object = tabh.get_colors_data(
+        columns[1], columns[0], colors, to_display=columns[2]
+    )
+    years = tabh.get_years(columns[0]).tolist()
+    # tables are written compact, minify is the fallback for indented html
+    raw_html = "\n    ".join(
+        tabh.year_table(year, color_object=color_object).replace("><", ">\n  <")
+        for year in years
+    )
+    html = tabh.table_html(dates, values, labels, palette=palette)
+    renderer = tabh.get_renderer()
+
+    return [
+        ("as_columns", lambda: tabh.as_columns(dates, values, labels)),
+        (
+            "get_colors_data",
+            lambda: tabh.get_colors_data(
+                columns[1], columns[0], colors, to_display=columns[2]
+            ),
+        ),
+        (
+            "get_colorkey",
+            lambda: tabh.get_colorkey(colors, 51, columns[1], columns[2]),
+        ),
+        (
+            "year_table",
+            lambda: [
+                tabh.year_table(year, color_object=color_object) for year in years
+            ],
+        ),
+        ("get_value_stats", lambda: tabh.get_value_stats(columns[1])),
+        ("get_scale outliers", lambda: tabh.get_scale(columns[1])),
+        ("get_scale quantiles", lambda: tabh.get_scale(columns[1], "quantiles")),
+        ("get_scale sketch", lambda: tabh.get_scale(columns[1], "sketch")),
+        ("minify", lambda: tabh.minify(raw_html)),
+        ("table_html", lambda: tabh.table_html(dates, values, labels, palette)),
+        (
+            "table_html css",
+            lambda: tabh.table_html(dates, values, labels, palette, css_classes=True),
+        ),
+        (
+            "table_html json",
+            lambda: tabh.table_html(dates, values, labels, palette, json_payload=True),
+        ),
+        ("create_page render", lambda: renderer.render(html, "Benchmark")),
+    ]
+
+
+def digest(html):
+    return hashlib.sha256(html.encode("utf8")).hexdigest()[:16]
+
+
+def check_paths(dates, values, labels, palette):
+    """all rendering paths of one series must give identical html"""
+    for options in MODES.values():
+        html = tabh.table_html(dates, values, labels, palette, **options)
+        streamed = "".join(
+            tabh.iter_table_html(dates, values, labels, palette, **options)
+        )
+        assert streamed == html, "iter_table_html differs from table_html"
+        heat_calendar = tabh.HeatCalendar(
+            dates[:-7], values[:-7], labels[:-7], palette, **options
+        )
+        heat_calendar.append(dates[-7:], values[-7:], labels[-7:])
+        assert heat_calendar.html() == html, "HeatCalendar differs from table_html"
+        listed = tabh.table_html(
+            dates.astype(object).tolist(), values.tolist(), labels, palette, **options
+        )
+        assert listed == html, "list input differs from array input"
+        undated = tabh.table_html(
+            np.insert(dates, [0, len(dates) // 2], np.datetime64("NaT", "D")),
+            np.insert(values, [0, len(values) // 2], 1.0),
+            ["n/d"] + labels[: len(labels) // 2] + ["n/d"] + labels[len(labels) // 2 :],
+            palette,
+            **options,
+        )
+        assert undated == html, "rows without a date are not left out"
+        if not options.get("json_payload"):
+            short = dates[:300], values[:300], labels[:300]
+            small = tabh.table_html(
+                short[0].astype(object).tolist(),
+                short[1].tolist(),
+                short[2],
+                palette,
+                **options,
+            )
+            assert small == tabh.table_html(
+                *short, palette, **options
+            ), "pure python path differs from numpy"
+
+
+def check_golden(print_golden=False):
+    failures = []
+    for density, missing in DENSITIES.items():
+        dates, values, labels = synthetic_series(GOLDEN_YEARS, missing)
+        for palette in PALETTES:
+            check_paths(dates, values, labels, palette)
+            for mode, options in MODES.items():
+                html = tabh.table_html(dates, values, labels, palette, **options)
+                key = (density, palette, mode)
+                if print_golden:
+                    print(f"    {key!r}: {digest(html)!r},")
+                elif GOLDEN.get(key) != digest(html):
+                    failures.append(key)
+    return failures
+
+
+def check_cache():
+    """pages written over a cache link must not change the cached page"""
+    dates, values, labels = synthetic_series(1, 0.0)
+    other = tabh.table_html(dates, values[::-1], labels)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = tabh.RenderCache(os.path.join(directory, "cache"))
+        output = os.path.join(directory, "cached.html")
+        cache.create_page(dates, values, labels, "Cached", output)
+        expected = tabh.get_renderer().render_bytes(
+            tabh.table_html(dates, values, labels), "Cached"
+        )
+        writers = [
+            lambda: tabh.create_page(other, "Other", output, startfile=False),
+            lambda: tabh.stream_page([other], "Other", output),
+            lambda: tabh.render_batch(
+                [("cached", dates, values[::-1], labels)], directory, workers=1
+            ),
+        ]
+        for i, write in enumerate(writers):
+            write()
+            copy = os.path.join(directory, f"copy{i}.html")
+            assert cache.create_page(dates, values, labels, "Cached", copy)
+            with open(copy, "rb") as f:
+                assert f.read() == expected, "RenderCache served an overwritten page"
+            cache.create_page(dates, values, labels, "Cached", output)
+
+
+def check_import(repeat):
+    """best cold import time in ms and the problems found"""
+    problems, best = [], float("inf")
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        import_ms, loaded, small_numpy = json.loads(output)
+        best = min(best, import_ms)
+    if loaded:
+        problems.append(f"import tabheatcal loads {', '.join(loaded)}")
+    if small_numpy:
+        problems.append("a small calendar loads numpy")
+    if best > IMPORT_BUDGET_MS:
+        problems.append(f"import takes {best:.1f} ms")
+    return best, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="1 and 5 years only")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--print-golden", action="store_true", help="print digests for GOLDEN"
+    )
+    args = parser.parse_args()
+
+    if args.print_golden:
+        check_golden(print_golden=True)
+        return
+
+    print(
+        f"{'years':>5} {'data':<7} {'palette':<10} {'stage':<20} {'ms':>9} {'peak KiB':>9}"
+    )
+    for years in YEARS[:2] if args.quick else YEARS:
+        for density, missing in DENSITIES.items():
+            dates, values, labels = synthetic_series(years, missing)
+            for palette in PALETTES:
+                for name, func in stages(dates, values, labels, palette):
+                    seconds, peak = measure(func, args.repeat)
+                    print(
+                        f"{years:>5} {density:<7} {palette:<10} {name:<20}"
+                        f" {seconds * 1000:>9.2f} {peak / 1024:>9.0f}"
+                    )
+
+    failures = check_golden()
+    if failures:
+        raise SystemExit(f"golden output mismatch: {failures}")
+    print("golden output: ok")
+
+    check_cache()
+    print("render cache: ok")
+
+    import_ms, problems = check_import(args.repeat)
+    if problems:
+        raise SystemExit(f"import regression: {'; '.join(problems)}")
+    print(f"cold import: {import_ms:.1f} ms, ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -44,11 +44,7 @@ def read_crime_csv( encoding='utf-8'):
 
 
 def create_crime_heatmap(df, output_file="crime_heatmap.html", title="Daily Crime Incidents"):
-    daily_counts = df.groupby(df['date'].dt.date).size().reset_index(name='count')
-
-    dates = [pd.to_datetime(date) for date in daily_counts['date']]
-    values = daily_counts['count'].tolist()
-    labels = [f"{val} incidents" for val in values]
+    dates, values, labels = tabh.aggregate_events(df['date'], label_format="%d incidents")
 
     html = tabh.table_html(dates, values, labels, palette='Blues')
     
@@ -63,11 +59,7 @@ def create_crime_heatmap(df, output_file="crime_heatmap.html", title="Daily Crim
 
 def create_crime_heatmap_by_state(df, state, output_file=None, title=None):
     state_df = df[df['bundesland'] == state]
-    daily_counts = state_df.groupby(state_df['date'].dt.date).size().reset_index(name='count')
-
-    dates = [pd.to_datetime(date) for date in daily_counts['date']]
-    values = daily_counts['count'].tolist()
-    labels = [f"{val} incid." for val in values]
+    dates, values, labels = tabh.aggregate_events(state_df['date'], label_format="%d incid.")
 
     if not output_file:
         output_file = f"{state}_crime_heatmap.html"
@@ -77,10 +69,22 @@ def create_crime_heatmap_by_state(df, state, output_file=None, title=None):
     html = tabh.table_html(dates, values, labels, palette='Blues')
     tabh.create_page(html, title=title, output=output_file, startfile=True)
 
+
+def create_crime_heatmaps_by_state(df, output_file="states_crime_heatmap.html",
+                                   title="Daily Crime Incidents by State"):
+    # one pass over all incidents gives the daily counts of every state
+    by_state = tabh.aggregate_events(df['date'],
+                                     groups=df['bundesland'].fillna('unbekannt'),
+                                     label_format="%d incid.")
+    panels = [(state, tabh.table_html(*series, palette='Blues'))
+              for state, series in by_state.items()]
+    tabh.create_multi_page(panels, title=title, output=output_file, startfile=True)
+
 def test_crime_heatmap():
     df = read_crime_csv( encoding='utf-8')
     create_crime_heatmap(df, output_file="crime_heatmap.html", title="Daily Crime Incidents")
     # create_crime_heatmap_by_state(df, 'Bayern', output_file="crime_heatmap.html", title="Daily Crime Incidents")
+    # create_crime_heatmaps_by_state(df)
 
 def test_yfinance():
     from html import escape
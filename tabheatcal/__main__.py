@@ -0,0 +1,132 @@
+"""python -m tabheatcal: heat calendar pages from CSV or Parquet files.
+
+    python -m tabheatcal prices.csv exports/ -o calendars -j 8
+
+every file becomes <output dir>/<file name>.html; directories are searched
+for .csv, .parquet and .pq files.
+"""
+
+import argparse
+import os
+import sys
+
+from .tabheatcal import COMPRESSION_SUFFIXES, SCALINGS, RenderCache, render_files
+
+INPUT_SUFFIXES = (".csv", ".parquet", ".pq")
+
+
+def input_files(inputs):
+    """files of inputs, directories expanded to their CSV and Parquet files"""
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(INPUT_SUFFIXES):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tabheatcal", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="CSV or Parquet files, or directories of them"
+    )
+    parser.add_argument("-o", "--output-dir", default=".")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="worker processes (default: one per CPU, 1 renders in this process)",
+    )
+    parser.add_argument("--date-column", help="default: the first column")
+    parser.add_argument("--value-column", help="default: the second column")
+    parser.add_argument(
+        "--label-column",
+        help="default: the third column, if no column is named; else no labels",
+    )
+    parser.add_argument(
+        "--label-format",
+        default="%.2f",
+        help="label of a value without label column (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--palette",
+        default="RdYlGn",
+        help="palette name (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--palette-size",
+        type=int,
+        help="resample the palette to this many colors (default: as defined)",
+    )
+    parser.add_argument(
+        "--scaling",
+        choices=SCALINGS,
+        default="outliers",
+        help="how the color scale is fitted to the values (default: %(default)s)",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--css-classes", action="store_true")
+    mode.add_argument("--json-payload", action="store_true")
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=65536,
+        help="rows read at a time (default: %(default)s)",
+    )
+    parser.add_argument("--cache", metavar="DIR", help="RenderCache directory")
+    parser.add_argument(
+        "--compress",
+        action="append",
+        choices=tuple(COMPRESSION_SUFFIXES),
+        help="also write <file name>.html.gz or .html.br; may be repeated",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        help="gzip level 1-9 or brotli quality 0-11 (default: the highest)",
+    )
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    paths = list(input_files(args.inputs))
+    if not paths:
+        parser.error("no CSV or Parquet files found")
+
+    def progress(done, result):
+        if not args.quiet:
+            status = result.output or f"{result.name}: {result.error}"
+            print(f"[{done}/{len(paths)}] {status}", file=sys.stderr)
+
+    try:
+        results = render_files(
+            paths,
+            output_dir=args.output_dir,
+            workers=args.workers,
+            progress=progress,
+            cache=RenderCache(args.cache) if args.cache else None,
+            date_column=args.date_column,
+            value_column=args.value_column,
+            label_column=args.label_column,
+            label_format=args.label_format,
+            batch_rows=args.batch_rows,
+            compress=args.compress,
+            compress_level=args.compress_level,
+            palette=args.palette,
+            palette_size=args.palette_size,
+            scaling=args.scaling,
+            css_classes=args.css_classes,
+            json_payload=args.json_payload,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    failed = [result for result in results if result.error]
+    if failed:
+        print(f"{len(failed)} of {len(results)} files failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
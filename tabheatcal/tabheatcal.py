@@ -4,35 +4,77 @@
 # Copyright (c)  Tomasz Sługocki ts.kontakt@gmail.com
 # This code is licensed under MIT
 import calendar
+import collections
 import datetime
+import errno
+import functools
+import hashlib
+import io
+import itertools
 import json
 import math
 import os
 import re
-import subprocess
 import sys
+import time
 
-import numpy as np
-from jinja2 import Environment, FileSystemLoader
-
-try:
-    import assets
-except ModuleNotFoundError:
-    from . import assets
+# numpy, jinja2 and the palettes are imported on first use, which keeps
+# "import tabheatcal" fast for short-lived scripts
 
 TEMPLATE_FILE = "template.html"
-try:
-    # python 3.9+
-    from importlib import resources
-
-    TEMPLATE_PATH = str(resources.files("tabheatcal"))
-except ImportError:
-    TEMPLATE_PATH = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.dirname(os.path.abspath(__file__))
 
 # x
 
 EMPTY_CELL = "empty"
 SQUARE_SIZE = 11
+# bump when rendering changes, so RenderCache entries of older output are missed
+CACHE_VERSION = 1
+# distinct (year, start_month, end_month) layouts kept by year_skeleton
+SKELETON_CACHE_SIZE = 128
+# list input of up to this many days is rendered in pure python, without numpy
+SMALL_INPUT = 1000
+# get_scale strategies, see there
+SCALINGS = ("outliers", "range", "quantiles", "sketch")
+# shares of values below and above the color scale with "quantiles" and "sketch"
+QUANTILE_RANGE = (0.01, 0.99)
+# values per QuantileSketch.update when get_scale streams an array
+SCALE_CHUNK = 2**20
+# colors of the built-in palettes; register_palette resamples to it by default
+PALETTE_SIZE = 100
+# palettes added by register_palette, name -> hex colors
+REGISTERED_PALETTES = {}
+# daily values aggregate_events computes from events
+AGGREGATIONS = ("count", "sum", "mean")
+# content encodings of compress_page, in order of preference, and their levels
+COMPRESSION_LEVELS = {"br": 11, "gzip": 9}
+# file name suffixes of compressed pages
+COMPRESSION_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# table_html options CalendarApp takes from the query string
+QUERY_OPTIONS = ("palette", "scaling", "css_classes", "json_payload")
+EMPTY_CELL_HTML = '<td style="border:white 1px solid;color:white;" >_</td>'
+
+STYLE_BLOCK = re.compile('<style type="text/css">.*?</style>', re.S)
+# wrapper of table_html: year tables on the left, color key on the right
+LAYOUT_HTML = (
+    '<table style="text-align: center;width:auto;" border="0" cellpadding="0"'
+    ' cellspacing="0"><tr><td id="heat_tables">%s</td><td id="color_wrap"'
+    ' style="vertical-align:top;padding:2.4rem 0px 0px 2rem;">%s</td></tr></table>'
+)
+# what minify would change: newlines, whitespace runs, a space between tags
+LOOSE_HTML = re.compile("\n|\\s\\s|> <")
+
+LEFT_BORDER = "border-left:black 1px solid;"
+LEFT_TOP_BORDER = "border-left:black 1px solid;border-top:black 1px solid;"
+TOP_BORDER = "border-top:gray 1px solid;"
+# class names used instead of inline styles when css_classes is on
+CSS_PREFIX = "hc"
+BORDER_CLASSES = {
+    LEFT_BORDER: f"{CSS_PREFIX}bl",
+    LEFT_TOP_BORDER: f"{CSS_PREFIX}blt",
+    TOP_BORDER: f"{CSS_PREFIX}bt",
+}
+EMPTY_CELL_CLASS_HTML = f'<td class="{CSS_PREFIX}e">_</td>'
 
 WEEKDAYS_NAMES = calendar.day_name
 WEEKDAYS_ORDER = (
@@ -54,18 +96,195 @@ def get_distance(x, y):
 
 
 def minify(htmlcode):
+    """drops newlines, shortens whitespace runs and removes a space between tags.
+
+    the tables are written compact already; this is the fallback for user
+    html such as labels, returned unchanged after one scan when compact.
+    """
+    if LOOSE_HTML.search(htmlcode) is None:
+        return htmlcode
     htmlcode = htmlcode.replace("\n", "")
     htmlcode = re.sub("\\s{2,}", " ", htmlcode)
     htmlcode = htmlcode.replace("> <", "><")
     return htmlcode
 
 
+class RenderStats:
+    """wall time, call count and output size of each render stage.
+
+    Pass one as stats= to table_html, iter_table_html or create_page; the
+    stages of several renders add up. Year tables are recorded per year as
+    "year_table <year>". callback(stage, seconds, size) is called for every
+    measurement, e.g. to feed a metrics client. Sizes of html stages are in
+    characters; "render" records the UTF-8 bytes of the page and "write"
+    the bytes of all files written.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        # stage -> [calls, seconds, size]
+        self.stages = {}
+
+    def record(self, stage, seconds, size=0):
+        entry = self.stages.setdefault(stage, [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += size
+        if self.callback is not None:
+            self.callback(stage, seconds, size)
+
+    def as_dict(self):
+        return {
+            stage: {"calls": calls, "seconds": seconds, "size": size}
+            for stage, (calls, seconds, size) in self.stages.items()
+        }
+
+    def report(self):
+        """one line per stage, slowest first"""
+        lines = [f"{'stage':<20} {'calls':>6} {'ms':>9} {'size':>10}"]
+        for stage, (calls, seconds, size) in sorted(
+            self.stages.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(f"{stage:<20} {calls:>6} {seconds * 1000:>9.2f} {size:>10}")
+        return "\n".join(lines)
+
+
+def timed(stats, stage, func, *args, **kwargs):
+    """func(*args, **kwargs), recorded in stats unless stats is None"""
+    if stats is None:
+        return func(*args, **kwargs)
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    size = len(result) if isinstance(result, (str, bytes)) else 0
+    stats.record(stage, time.perf_counter() - start, size)
+    return result
+
+
 def open_file(filename):
+    """opens filename in the default viewer without waiting for it"""
     if sys.platform == "win32":
         os.startfile(filename)
     else:
+        import subprocess
+
         opener = "open" if sys.platform == "darwin" else "xdg-open"
-        subprocess.call([opener, filename])
+        subprocess.Popen(
+            [opener, filename],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+
+def load_assets():
+    try:
+        import assets
+    except ModuleNotFoundError:
+        from . import assets
+    return assets
+
+
+def palette_names():
+    """names of the built-in and the registered palettes"""
+    assets = load_assets()
+    names = {
+        name
+        for name, colors in vars(assets).items()
+        if not name.startswith("_")
+        and isinstance(colors, (list, tuple))
+        and all(isinstance(color, str) for color in colors)
+    }
+    return sorted(names | REGISTERED_PALETTES.keys())
+
+
+@functools.lru_cache(maxsize=None)
+def get_palette(name, size=None):
+    """hex colors of a registered or built-in palette, loaded on first use.
+
+    with size the palette is resampled to that many colors, see
+    get_palette_lut.
+    """
+    if size is not None:
+        return hex_colors(get_palette_lut(name, size))
+    if name in REGISTERED_PALETTES:
+        return REGISTERED_PALETTES[name]
+    colors = getattr(load_assets(), name, None)
+    if not isinstance(colors, (list, tuple)) or name.startswith("_"):
+        raise ValueError(f"unknown palette {name!r}, expected one of {palette_names()}")
+    return tuple(colors)
+
+
+@functools.lru_cache(maxsize=None)
+def get_palette_lut(name, size=None):
+    """read-only uint8 array of the RGB rows of a palette.
+
+    With size the palette is interpolated linearly to size rows; the
+    resampled tables are cached. get_palette(name, size) gives the same
+    colors as hex strings, which table_html(palette_size=size) renders with.
+    """
+    lut = parse_colors(get_palette(name))
+    if size is not None and size != len(lut):
+        lut = resample_palette(lut, size)
+    lut.flags.writeable = False
+    return lut
+
+
+def parse_colors(colors):
+    """uint8 RGB array of "#RRGGBB" or "#RGB" strings or (r, g, b) rows"""
+    import numpy as np
+
+    rows = []
+    for color in colors:
+        if isinstance(color, str):
+            digits = color.lstrip("#")
+            if len(digits) == 3:
+                digits = "".join(digit * 2 for digit in digits)
+            if len(digits) != 6:
+                raise ValueError(f"invalid color {color!r}")
+            rows.append(tuple(bytes.fromhex(digits)))
+        else:
+            rows.append(tuple(color))
+    lut = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    if not len(lut) or lut.min() < 0 or lut.max() > 255:
+        raise ValueError("palette colors must be 0-255 RGB rows")
+    return lut.astype(np.uint8)
+
+
+def resample_palette(lut, size):
+    """RGB array of size colors spread evenly over the colors of lut"""
+    import numpy as np
+
+    if size < 1:
+        raise ValueError("a palette needs at least one color")
+    lut = np.asarray(lut, dtype=np.float64)
+    if len(lut) == 1:
+        return np.repeat(lut, size, axis=0).astype(np.uint8)
+    positions = np.linspace(0, len(lut) - 1, size)
+    anchors = np.arange(len(lut))
+    channels = [np.interp(positions, anchors, lut[:, i]) for i in range(3)]
+    return np.rint(np.stack(channels, axis=1)).astype(np.uint8)
+
+
+def hex_colors(lut):
+    """ "#RRGGBB" strings of the rows of an RGB array"""
+    return tuple("#%02X%02X%02X" % tuple(row) for row in lut.tolist())
+
+
+def register_palette(name, colors, size=PALETTE_SIZE):
+    """adds a palette for palette=name from a few colors.
+
+    colors are "#RRGGBB" strings or (r, g, b) rows, from the lowest value to
+    the highest, interpolated to size colors (None keeps them as given). A
+    registered name hides a built-in palette of that name. Returns the hex
+    colors.
+    """
+    lut = parse_colors(colors)
+    if size is not None:
+        lut = resample_palette(lut, size)
+    REGISTERED_PALETTES[name] = hex_colors(lut)
+    get_palette.cache_clear()
+    get_palette_lut.cache_clear()
+    return REGISTERED_PALETTES[name]
 
 
 def set_days(year, starting_month=1, end_month=12):
@@ -82,26 +301,21 @@ def set_days(year, starting_month=1, end_month=12):
     return weekdays_obj
 
 
-def year_table(current_year, start_month=1, end_month=12, color_object=None):
-    strftime = datetime.datetime.strftime
+@functools.lru_cache(maxsize=SKELETON_CACHE_SIZE)
+def year_skeleton(current_year, start_month=1, end_month=12, css_classes=False):
+    """data independent layout of a year table, cached per (year, months).
 
-    def make_cell(inner_html, style="", rel="", css_id=""):
-        if style:
-            style = f'style="{style}"'
-        if rel:
-            rel = f'rel="{rel}"'
-        if css_id:
-            css_id = f'css_id="{css_id}"'
-        attributes = " ".join((style, rel, css_id))
-        return f"<td {attributes} >{inner_html}</td>"
+    returns (rows, bottom_row, ordinals, cell_end): each row is
+    (row_start, heads, tails) where row_start holds the <tr>, the weekday
+    header and the empty cells, and every day cell is emitted as
+    head + fill + tail + label + cell_end. ordinals lists the days of all
+    cells in emission order.
+    """
+    strftime = datetime.datetime.strftime
 
     def make_row(inner_html):
         return f"<tr>{inner_html}</tr>"
 
-    left_border = "border-left:black 1px solid;"
-    left_top_border = "border-left:black 1px solid;border-top:black 1px solid;"
-    top_border = "border-top:gray 1px solid;"
-
     weekdays_data = set_days(
         current_year, starting_month=start_month, end_month=end_month
     )
@@ -111,53 +325,51 @@ def year_table(current_year, start_month=1, end_month=12, color_object=None):
         for i in range(0, first_day_of_year.weekday() + 1):
             weekdays_data[WEEKDAYS_ORDER[i]].insert(0, EMPTY_CELL)
 
-    bottom_table_headers, table_rows = [], []
+    bottom_table_headers, rows, ordinals = [], [], []
     for weekday in WEEKDAYS_ORDER:
-        table_cells = []
+        empty_cells, heads, tails = [], [], []
         previous_month = None
         bottom_column_span = 0
 
         for date_item in weekdays_data[weekday]:
             if date_item != EMPTY_CELL:
                 is_empty = False
-                date_string_key = strftime(date_item, "%Y-%m-%d")
-                background_color = color_object.get(date_string_key, {}).get(
-                    "color", "white"
-                )
-                date_display_string = color_object.get(date_string_key, {}).get(
-                    "info", date_string_key
-                )
                 current_month = date_item.month
                 current_day = date_item.day
             else:
-                background_color = ""
                 is_empty = True
-                date_display_string = ""
                 current_month = 0
                 previous_month = None
                 current_day = 0
-            css_color_styles = (
-                f"background:{background_color};color:{background_color};"
-            )
 
-            cell_style = css_color_styles
+            style_prefix = ""
             if previous_month != current_month and is_empty != True:
                 if current_day == 1:
-                    cell_style = left_top_border + css_color_styles
+                    style_prefix = LEFT_TOP_BORDER
                 else:
-                    cell_style = left_border + css_color_styles
+                    style_prefix = LEFT_BORDER
 
+            style_suffix = ""
             if weekday == 6:
-                cell_style += top_border
+                style_suffix = TOP_BORDER
 
-            cell_inner_html = "."
             if is_empty:
-                cell_inner_html = "_"
-                cell_style = "border:white 1px solid;color:white;"
-
-            table_cell = make_cell(
-                cell_inner_html, style=cell_style, rel=date_display_string
-            )
+                empty_cells.append(EMPTY_CELL_HTML)
+            elif css_classes:
+                date_string_key = strftime(date_item, "%Y-%m-%d")
+                classes = "".join(
+                    BORDER_CLASSES[style] + " "
+                    for style in (style_prefix, style_suffix)
+                    if style
+                )
+                heads.append(f'<td class="{classes}')
+                tails.append(f'" rel="{date_string_key}')
+                ordinals.append(date_item.toordinal())
+            else:
+                date_string_key = strftime(date_item, "%Y-%m-%d")
+                heads.append(f'<td style="{style_prefix}background:')
+                tails.append(f';{style_suffix}" rel="{date_string_key}')
+                ordinals.append(date_item.toordinal())
 
             saturday_first_day = (
                 weekday == 5
@@ -178,7 +390,7 @@ def year_table(current_year, start_month=1, end_month=12, color_object=None):
                 # for years starting with  Sunday we need add extra th row
                 if first_day_of_year.weekday() == 6 and previous_month == 1:
                     bottom_header_string = (
-                        '<th style="color:gray;" scope="row">_</th> '
+                        '<th style="color:gray;" scope="row">_</th>'
                         + bottom_header_string
                     )
 
@@ -186,8 +398,6 @@ def year_table(current_year, start_month=1, end_month=12, color_object=None):
                 bottom_column_span = 0
 
             bottom_column_span += 1
-
-            table_cells.append(table_cell)
             previous_month = current_month
 
         table_header_row = f'<th scope="row">{WEEKDAYS_NAMES[weekday]}</th>'
@@ -196,7 +406,10 @@ def year_table(current_year, start_month=1, end_month=12, color_object=None):
                 f'<th style="color:gray;" scope="row">{WEEKDAYS_NAMES[weekday]}</th>'
             )
 
-        table_rows.append(make_row(table_header_row + "".join(table_cells)))
+        if css_classes:
+            empty_cells = [EMPTY_CELL_CLASS_HTML] * len(empty_cells)
+        row_start = "<tr>" + table_header_row + "".join(empty_cells)
+        rows.append((row_start, tuple(heads), tuple(tails)))
 
     bottom_header_string = f'<td colspan="{
         bottom_column_span
@@ -208,27 +421,100 @@ def year_table(current_year, start_month=1, end_month=12, color_object=None):
     if first_day_of_year.weekday() == 6:
         first_month_separator = ""
 
-    table_rows.append(make_row(first_month_separator + "".join(bottom_table_headers)))
-    html_head = f'<h3 class="year_cal">{current_year}</h3>'
-    html_table = f"""{html_head}
-    <table summary='Heat calendar'
-        class="cal_heat" border="0" cellpadding="0" cellspacing="0">
-        {chr(10).join(table_rows)}
+    bottom_row = make_row(first_month_separator + "".join(bottom_table_headers))
+    ordinals = tuple(ordinals)
+    cell_end = '">.</td>' if css_classes else '" >.</td>'
+    return tuple(rows), bottom_row, ordinals, cell_end
 
-        </table>
 
+def year_table(
+    current_year, start_month=1, end_month=12, color_object=None, css_classes=False
+):
+    """html table of one year.
+
+    without color_object only the bare skeleton is written, to be colored
+    client side from get_payload data.
     """
-    return html_table
+    if color_object is None:
+        return bare_year_table(current_year, start_month, end_month)
+    return "".join(
+        iter_year_table(current_year, start_month, end_month, color_object, css_classes)
+    )
+
+
+def iter_year_table(
+    current_year, start_month=1, end_month=12, color_object=None, css_classes=False
+):
+    """yields the html of year_table one row at a time"""
+    if color_object is None:
+        yield bare_year_table(current_year, start_month, end_month)
+        return
+
+    rows, bottom_row, ordinals, cell_end = year_skeleton(
+        current_year, start_month, end_month, css_classes
+    )
+    fills, labels = color_object.lookup(ordinals, css_classes)
 
+    yield (
+        f'<h3 class="year_cal">{current_year}</h3>'
+        '<table summary=\'Heat calendar\' class="cal_heat" border="0"'
+        ' cellpadding="0" cellspacing="0">'
+    )
+    cell = 0
+    for row_start, heads, tails in rows:
+        row_cells = [row_start]
+        for head, tail in zip(heads, tails):
+            fill, label = fills[cell], labels[cell]
+            label = "" if label is None else ";" + label
+            row_cells.append(f"{head}{fill}{tail}{label}{cell_end}")
+            cell += 1
+        row_cells.append("</tr>")
+        yield "".join(row_cells)
+    yield bottom_row + "</table>"
+
+
+@functools.lru_cache(maxsize=SKELETON_CACHE_SIZE)
+def bare_year_table(current_year, start_month=1, end_month=12):
+    rows, bottom_row, _, _ = year_skeleton(current_year, start_month, end_month, True)
+    table_rows = [
+        row_start + "".join(head.rstrip() + '">.</td>' for head in heads) + "</tr>"
+        for row_start, heads, _ in rows
+    ]
+    table_rows.append(bottom_row)
+    first_day = datetime.date(current_year, start_month, 1)
+    return (
+        f'<h3 class="year_cal">{current_year}</h3>'
+        f"<table summary='Heat calendar' data-start=\"{first_day.isoformat()}\""
+        ' class="cal_heat" border="0" cellpadding="0" cellspacing="0">'
+        + "".join(table_rows)
+        + "</table>"
+    )
 
-def get_colorkey(colors, divisions, values, labels):
-    assert len(colors) > divisions
+
+def get_colorkey(colors, divisions, values, labels, value_stats=None):
+    """color key with the labels of the largest, median and smallest value"""
+    if value_stats is None:
+        value_stats = get_value_stats(values, outliers=False)
+    assert value_stats.count < len(values) or value_stats.total
+    max_label, mid_label, min_label = take_labels(
+        labels, [value_stats.max_at, value_stats.mid_at, value_stats.min_at]
+    )
+    return colorkey_html(
+        colors,
+        divisions,
+        value_stats.max,
+        value_stats.min,
+        max_label,
+        mid_label,
+        min_label,
+    )
+
+
+def colorkey_html(colors, divisions, max_val, min_val, max_label, mid_label, min_label):
+    if len(colors) <= divisions:
+        # each color of a short palette gets a band as high as a full key
+        colors = [colors[i * len(colors) // PALETTE_SIZE] for i in range(PALETTE_SIZE)]
     step = int(len(colors) / divisions)
-    assert sum(values)
-    max_val = float(np.nanmax(values))
-    min_val = float(np.nanmin(values))
-    max_label = labels[values.index(max_val)]
-    min_label = labels[values.index(min_val)]
     max_label = max_label.split(";")[0]
     min_label = min_label.split(";")[0]
     val_range = get_distance(min_val, max_val)
@@ -236,143 +522,2126 @@ def get_colorkey(colors, divisions, values, labels):
     tick_step = val_range / float(ticks)
     current = max_val
     height, width, float_style = 2, 1.5, "None"
-    css = f"""
-    <style type="text/css">
-    div.color_key {{
-        font-size:1px;height:{height}px;width:{width}rem;
-        margin:0px 0px 0px 0px;padding: 0px 0px 0px 0px;
-        display:block;float:{float_style};
-    }}
-    div.colorkey_tick {{
-      font-weight:600;
-      position:absolute;
-      font-size:0.7rem;
-    }}
-    </style>
-    """
+    css = (
+        '<style type="text/css"> div.color_key { font-size:1px;'
+        f"height:{height}px;width:{width}rem; margin:0px 0px 0px 0px;"
+        f"padding: 0px 0px 0px 0px; display:block;float:{float_style}; }} "
+        "div.colorkey_tick { font-weight:600; position:absolute;"
+        " font-size:0.7rem; } </style>"
+    )
     tick_html = (
-        f' <div class="colorkey_tick" style="top:-0.5em;right:0;">{max_label}</div>'
+        f'<div class="colorkey_tick" style="top:-0.5em;right:0;">{max_label}</div>'
     )
 
-    # mid_label = labels[values.index(np.median(values))]
-    mid_label = labels[np.argsort(values)[len(values) // 2]]
-
-    tick_html += f"""<div class="colorkey_tick"
-            style="top:49%;right:0;"> {mid_label}</div>"""
+    tick_html += (
+        f'<div class="colorkey_tick" style="top:49%;right:0;"> {mid_label}</div>'
+    )
     for i in range(ticks - 1):
         current -= tick_step
-    tick_html += f"""<div class="colorkey_tick"
-            style="bottom:-0.5em;right:0;">
-            {min_label}</div>"""
+    tick_html += (
+        '<div class="colorkey_tick" style="bottom:-0.5em;right:0;">'
+        f" {min_label}</div>"
+    )
     data = {"max": max_val, "min": min_val, "rng": val_range}
     json_str = json.dumps(data, separators=(",", ":"))
-    script = f'\n<script type="text/javascript"> var COLOR_KEY={json_str};</script>'
+    script = f'<script type="text/javascript"> var COLOR_KEY={json_str};</script>'
     divs = ""
     for i, color in enumerate(reversed(colors)):
         if i % step == 0:
             div = f'<div id="legend_wrapper" class="color_key" style="background:{color};">.</div>'
             divs += div
-    html = f"""{css}{script}
-        <div id="right_legend" style="text-align:left;min-width:4rem;position:relative;">
-        <div id="color_key_wrapper"> {divs} </div>
-         {tick_html}
-         </div>
-        """
+    html = (
+        f"{css}{script}"
+        '<div id="right_legend" style="text-align:left;min-width:4rem;position:relative;">'
+        f'<div id="color_key_wrapper">{divs}</div>{minify(tick_html)}</div>'
+    )
     return html
 
 
-def get_colors_data(values, dates, palette, to_display):
-    strftime = datetime.datetime.strftime
+# datetime64[D] counts days from 1970-01-01, which is this proleptic ordinal
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
 
-    def reject_outliers(data, m=4):
-        return data[abs(data - np.mean(data)) < m * np.std(data)]
+def is_arrow(column):
+    """True for pyarrow arrays, chunked arrays and tables"""
+    return type(column).__module__.split(".")[0] == "pyarrow"
 
-    stats_data = np.array(values)
-    stats_data = stats_data[np.logical_not(np.isnan(stats_data))]
-    stats_data = reject_outliers(stats_data, m=4)
 
-    max_ret = np.nanmax(stats_data)
-    min_ret = np.nanmin(stats_data)
+def arrow_to_numpy(column):
+    """numpy array of a pyarrow Array or ChunkedArray.
 
-    overall_rng = get_distance(min_ret, max_ret)
+    it shares the Arrow memory unless the column has nulls, several chunks or
+    a type numpy cannot view; timestamps with a time zone become local time.
+    """
+    if getattr(column.type, "tz", None) is not None:
+        import pyarrow.compute as pc
+
+        column = pc.local_timestamp(column)
+    if hasattr(column, "num_chunks"):
+        if column.num_chunks == 1:
+            column = column.chunk(0)
+        else:
+            column = column.combine_chunks()
+    try:
+        return column.to_numpy(zero_copy_only=True)
+    except Exception:
+        return column.to_numpy(zero_copy_only=False)
+
+
+def take_labels(labels, indices):
+    """labels at row indices as a list; only these labels are converted.
+
+    null pyarrow labels become "", as in parquet_batches.
+    """
+    import numpy as np
+
+    if isinstance(labels, np.ndarray):
+        return labels[indices].tolist()
+    if is_arrow(labels):
+        labels = labels.take(np.asarray(indices, dtype=np.int64)).to_pylist()
+        return ["" if label is None else label for label in labels]
+    return [labels[i] for i in np.asarray(indices).tolist()]
+
+
+def html_labels(labels):
+    """labels as written in the rel attribute of cells, minified"""
+    labels = ["%s" % (label,) for label in labels]
+    # "\0" keeps matches from spanning two labels
+    if LOOSE_HTML.search("\0".join(labels)):
+        labels = [minify(label) for label in labels]
+    return labels
+
+
+def as_day_array(dates):
+    """converts dates (sequence, datetime64 array, pandas or pyarrow column) to datetime64[D]"""
+    if is_arrow(dates):
+        dates = arrow_to_numpy(dates)
+    accessor = getattr(dates, "dt", dates)
+    if getattr(accessor, "tz", None) is not None:
+        # keep local calendar days instead of converting to UTC
+        dates = accessor.tz_localize(None)
+    import numpy as np
+
+    dates = np.asarray(dates)
+    if dates.dtype.kind == "M":
+        return dates.astype("datetime64[D]", copy=False)
+    if dates.dtype == object:
+        # numpy reads None as NaT, but not pandas.NaT, which is not equal to itself
+        missing = dates != dates
+        if missing.any():
+            dates = np.where(missing, None, dates)
+    return dates.astype("datetime64[D]")
+
+
+def day_ordinals(dates):
+    """converts dates to an int64 array of proleptic ordinals"""
+    import numpy as np
+
+    return as_day_array(dates).astype(np.int64) + EPOCH_ORDINAL
+
+
+class ColorData:
+    """palette indices of values (-1 for NaN), addressable by day ordinal"""
+
+    def __init__(self, ordinals, indices, labels, palette):
+        import numpy as np
+
+        self.palette = palette
+        self.labels = labels
+        self.indices = indices
+        self.first = int(ordinals.min())
+        self.positions = np.full(int(ordinals.max()) - self.first + 1, -1, np.int64)
+        # later values for the same day win, as they did in the old dict
+        self.positions[ordinals - self.first] = np.arange(len(ordinals))
+
+    @functools.cached_property
+    def day_labels(self):
+        """html_labels of each day from first, None for days without data.
+
+        only the labels shown in cells are converted, one per day.
+        """
+        import numpy as np
+
+        shown = np.flatnonzero(self.positions >= 0)
+        labels = html_labels(take_labels(self.labels, self.positions[shown]))
+        day_labels = [None] * len(self.positions)
+        for offset, label in zip(shown.tolist(), labels):
+            day_labels[offset] = label
+        return day_labels
+
+    def lookup(self, ordinals, css_classes=False):
+        """returns cell fills and cell labels of days; None without data.
+
+        a fill is the inline "color;color:color" style value or, with
+        css_classes, the palette class name.
+        """
+        import numpy as np
+
+        offsets = np.asarray(ordinals, dtype=np.int64) - self.first
+        inside = (offsets >= 0) & (offsets < len(self.positions))
+        positions = np.full(len(offsets), -1, np.int64)
+        positions[inside] = self.positions[offsets[inside]]
+        has_data = positions >= 0
+        color_indices = np.full(len(offsets), -1, np.int64)
+        color_indices[has_data] = self.indices[positions[has_data]]
+        fills = cell_fills(self.palette, css_classes)
+        fills = np.array(fills, dtype=object)[color_indices].tolist()
+        day_labels = self.day_labels
+        labels = [
+            day_labels[offset] if inside else None
+            for offset, inside in zip(offsets.tolist(), inside.tolist())
+        ]
+        return fills, labels
+
+
+def cell_fills(palette, css_classes=False):
+    """fill of each palette index; index -1 (no data or NaN) picks the trailing white"""
+    if css_classes:
+        fills = [f"{CSS_PREFIX}{i}" for i in range(len(palette))]
+        fills.append(f"{CSS_PREFIX}w")
+    else:
+        fills = [f"{color};color:{color}" for color in palette]
+        fills.append("white;color:white")
+    return fills
+
+
+# statistics of the values that the color key and the color scale share
+ValueStats = collections.namedtuple(
+    "ValueStats", "count total min max min_at max_at mid_at low high"
+)
+
+
+def outlier_range(data, total, min_val, max_val, m=4):
+    """(min, max) of the data less than m standard deviations from the mean,
+    given the sum, min and max of data"""
+    import numpy as np
+
+    # the mean and deviation np.mean and np.std compute, bit for bit
+    mean = total / len(data)
+    deviations = data - mean
+    limit = m * np.sqrt(np.add.reduce(deviations * deviations) / len(data))
+    # deviations grow towards both ends of the data
+    if abs(min_val - mean) < limit and abs(max_val - mean) < limit:
+        return min_val, max_val
+    kept = data[np.abs(deviations) < limit]
+    return float(kept.min()), float(kept.max())
+
+
+def get_value_stats(values, outliers=True):
+    """ValueStats of float values, NaN ignored, in O(n).
+
+    count and total are those of the values without NaN. min_at and max_at
+    index the first smallest and largest value, mid_at the value a stable
+    sort (NaN last) puts in the middle; np.partition finds it without the
+    sort. With outliers, low and high are the outlier_range,
+    else None.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    nan_mask = np.isnan(values)
+    count = len(values) - int(np.count_nonzero(nan_mask))
+    if not count:
+        raise ValueError("no values to scale")
+    if count < len(values):
+        present = np.flatnonzero(~nan_mask)
+        data = values[present]
+    else:
+        present, data = None, np.ascontiguousarray(values)
+    min_at, max_at = int(data.argmin()), int(data.argmax())
+    min_val, max_val = float(data[min_at]), float(data[max_at])
+    if present is not None:
+        min_at, max_at = int(present[min_at]), int(present[max_at])
+
+    middle = len(values) // 2
+    if middle >= count:
+        mid_at = int(np.flatnonzero(nan_mask)[middle - count])
+    else:
+        mid_val = np.partition(data, middle)[middle]
+        # equal values keep their order, so take the right occurrence
+        occurrence = middle - int(np.count_nonzero(data < mid_val))
+        mid_at = int(np.flatnonzero(values == mid_val)[occurrence])
+
+    total = np.add.reduce(data)
+    low = high = None
+    if outliers:
+        low, high = outlier_range(data, total, min_val, max_val)
+    return ValueStats(
+        count, float(total), min_val, max_val, min_at, max_at, mid_at, low, high
+    )
+
+
+def color_indices(values, palette_len, min_ret, max_ret):
+    """bins values into palette_len colors between min_ret and max_ret (-1 for NaN)"""
+    import numpy as np
+
+    overall_rng = get_distance(min_ret, max_ret) or 1.0
+    values = np.asarray(values, dtype=np.float64)
+    nan_mask = np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        # same operation order as the scalar code, so bins match bit for bit
+        distance_min = np.maximum(values - min_ret, 0.0) / overall_rng
+        positions = np.floor(distance_min * palette_len)
+    positions = np.clip(np.where(nan_mask, 0, positions), 0, palette_len - 1)
+    indices = positions.astype(np.int16 if palette_len < 2**15 else np.int32)
+    indices[nan_mask] = -1
+    return indices
+
+
+def quantile_rank(q, count):
+    """index of quantile q in count sorted values, as np.quantile(method="lower")"""
+    if not 0 <= q <= 1:
+        raise ValueError(f"quantile {q} is not between 0 and 1")
+    return int(q * (count - 1))
+
+
+def quantile_scale(data, low, high):
+    """exact (low, high) quantiles of a NaN-free array, found by np.partition"""
+    import numpy as np
 
-    palette_len = len(palette)
-    colors_dict = {}
-    for i, elem in enumerate(values):
-        day = strftime(dates[i], "%Y-%m-%d")
+    if not len(data):
+        raise ValueError("no values to scale")
+    ranks = [quantile_rank(low, len(data)), quantile_rank(high, len(data))]
+    data = np.partition(data, ranks)
+    return float(data[ranks[0]]), float(data[ranks[1]])
 
-        num_str = to_display[i]
 
-        final_str = "%s;%s" % (day, num_str)
-        if math.isnan(elem):
-            colors_dict[day] = {"color": "white", "info": final_str}
+class QuantileSketch:
+    """approximate quantiles of a stream of value chunks in bounded memory.
+
+    values are counted in logarithmic buckets (the DDSketch scheme), so a
+    quantile is off by at most relative_accuracy of its value and memory
+    grows with the range of magnitudes, not with the number of values.
+    Sketches of separate chunks can be merged. NaN and infinite values are
+    skipped.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bucket index -> count; bucket i holds magnitudes in (gamma**(i-1), gamma**i]
+        self.positive = collections.Counter()
+        self.negative = collections.Counter()
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        """adds a chunk of values; returns the sketch"""
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return self
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.zeros += int(np.count_nonzero(values == 0))
+        for buckets, magnitudes in (
+            (self.positive, values[values > 0]),
+            (self.negative, -values[values < 0]),
+        ):
+            if len(magnitudes):
+                keys = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+                first = int(keys.min())
+                counts = np.bincount(keys - first)
+                used = np.flatnonzero(counts)
+                for key, count in zip((used + first).tolist(), counts[used].tolist()):
+                    buckets[key] += count
+        return self
+
+    def merge(self, other):
+        """adds the counts of a sketch with the same accuracy; returns the sketch"""
+        if other.gamma != self.gamma:
+            raise ValueError("sketches of different accuracy")
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """approximate value at quantile q, 0 <= q <= 1"""
+        if not self.count:
+            raise ValueError("no values to scale")
+        rank = quantile_rank(q, self.count)
+        if rank == 0:
+            return self.min
+        if rank == self.count - 1:
+            return self.max
+        # ascending values: negative buckets by falling magnitude, zeros, positive
+        buckets = [(-1.0, key, self.negative[key]) for key in sorted(self.negative)]
+        buckets.reverse()
+        buckets.append((0.0, 0, self.zeros))
+        buckets.extend((1.0, key, self.positive[key]) for key in sorted(self.positive))
+        seen = 0
+        for sign, key, count in buckets:
+            seen += count
+            if seen > rank:
+                value = sign * 2 * self.gamma**key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def scale(self, low=QUANTILE_RANGE[0], high=QUANTILE_RANGE[1]):
+        """(min, max) color scale clipped at the low and high quantiles"""
+        return self.quantile(low), self.quantile(high)
+
+
+def get_scale(values, scaling="outliers", quantiles=QUANTILE_RANGE, value_stats=None):
+    """(min, max) of values spanned by the palette, NaN ignored.
+
+    scaling keeps outliers off the scale: "outliers" drops values more than
+    4 standard deviations from the mean, "range" keeps every value,
+    "quantiles" clips at the exact quantiles and "sketch" at those of a
+    QuantileSketch, which reads the values in chunks of SCALE_CHUNK (for
+    memory-mapped input). A (min, max) pair is used as it is.
+    "outliers" and "range" take their result from value_stats if given.
+    """
+    import numpy as np
+
+    if not isinstance(scaling, str):
+        min_ret, max_ret = scaling
+        return float(min_ret), float(max_ret)
+    if scaling not in SCALINGS:
+        raise ValueError(f"unknown scaling {scaling!r}, expected one of {SCALINGS}")
+    if value_stats is not None:
+        if scaling == "range":
+            return value_stats.min, value_stats.max
+        if scaling == "outliers" and value_stats.low is not None:
+            return value_stats.low, value_stats.high
+    values = np.asarray(values, dtype=np.float64)
+    if scaling == "sketch":
+        sketch = QuantileSketch()
+        for start in range(0, len(values), SCALE_CHUNK):
+            sketch.update(values[start : start + SCALE_CHUNK])
+        return sketch.scale(*quantiles)
+
+    stats_data = values[np.logical_not(np.isnan(values))]
+    if scaling == "quantiles":
+        return quantile_scale(stats_data, *quantiles)
+    if not len(stats_data):
+        raise ValueError("no values to scale")
+    min_ret, max_ret = float(stats_data.min()), float(stats_data.max())
+    if scaling == "outliers":
+        total = np.add.reduce(stats_data)
+        return outlier_range(stats_data, total, min_ret, max_ret)
+    return min_ret, max_ret
+
+
+def get_colors_data(values, dates, palette, to_display, scale=None):
+    min_ret, max_ret = scale or get_scale(values)
+    indices = color_indices(values, len(palette), min_ret, max_ret)
+    return ColorData(day_ordinals(dates), indices, to_display, palette)
+
+
+def get_payload(color_object):
+    """per-day palette indices and labels for client side coloring.
+
+    fills holds one int16 per day from start (-1 white, -2 no data) and
+    days one int32 index into the label table (-1 none), both base64 encoded
+    little-endian arrays.
+    """
+    import base64
+
+    import numpy as np
+
+    positions = color_object.positions
+    has_data = positions >= 0
+    fills = np.full(len(positions), -2, dtype="<i2")
+    fills[has_data] = color_object.indices[positions[has_data]]
+    # labels of the shown rows only
+    labels = take_labels(color_object.labels, positions[has_data])
+    labels = np.asarray(labels, dtype=object).astype(str)
+    label_table, label_ids = np.unique(labels, return_inverse=True)
+    days = np.full(len(positions), -1, dtype="<i4")
+    days[has_data] = label_ids
+    data = {
+        "start": datetime.date.fromordinal(color_object.first).isoformat(),
+        "fills": base64.b64encode(fills.tobytes()).decode("ascii"),
+        "labels": label_table.tolist(),
+        "days": base64.b64encode(days.tobytes()).decode("ascii"),
+    }
+    # "</" would end the script element early
+    json_str = json.dumps(data, separators=(",", ":")).replace("</", "<\\/")
+    return f'<script type="application/json" class="heat_data">{json_str}</script>'
+
+
+def palette_css(palette):
+    """stylesheet with one class per palette color plus the border variants"""
+    # two classes outrank the ".cal_heat td" defaults of the page template
+    selector = f".cal_heat .{CSS_PREFIX}"
+    rules = [
+        f"{selector}{i}{{background:{color};color:{color}}}"
+        for i, color in enumerate(palette)
+    ]
+    rules.append(f"{selector}w{{background:white;color:white}}")
+    # later rules win, so the gray top border overrides the black one
+    for style, class_name in BORDER_CLASSES.items():
+        rules.append(f".cal_heat .{class_name}{{{style}}}")
+    rules.append(f"{selector}e{{border:white 1px solid;color:white}}")
+    return '<style type="text/css">%s</style>' % "".join(rules)
+
+
+def layout_head(colors, color_object, css_classes=False, json_payload=False):
+    """markup of table_html before the first year table"""
+    head = LAYOUT_HTML.split("%s")[0]
+    if json_payload:
+        head += minify(get_payload(color_object))
+    if css_classes or json_payload:
+        return palette_css(colors) + head
+    # inline tables have always started with the space left of the
+    # indentation of the old layout template
+    return " " + head
+
+
+def as_columns(dates, values, labels):
+    """dates as datetime64[D], values as float64 and labels as object arrays.
+
+    numpy arrays (also numpy.memmap) of these types are used without a copy.
+    pyarrow columns share their memory where the type allows it, and pyarrow
+    or numpy string labels are kept as they are; only the labels shown are
+    converted later. Rows without a date (NaT, None, null) are dropped.
+    """
+    import numpy as np
+
+    dates = as_day_array(dates)
+    if is_arrow(values):
+        values = arrow_to_numpy(values)
+    values = np.asarray(values, dtype=np.float64)
+    if not is_arrow(labels) and not (
+        isinstance(labels, np.ndarray) and labels.dtype.kind in "OU"
+    ):
+        labels = np.asarray(labels, dtype=object)
+    assert len(dates) == len(values) == len(labels)
+    missing = np.isnat(dates)
+    if missing.any():
+        keep = ~missing
+        dates, values = dates[keep], values[keep]
+        labels = labels.filter(keep) if is_arrow(labels) else labels[keep]
+    assert len(dates)
+    return dates, values, labels
+
+
+def get_years(dates):
+    """sorted distinct years of a datetime64 array"""
+    import numpy as np
+
+    return np.unique(dates.astype("datetime64[Y]").astype(np.int64) + 1970)
+
+
+# pure python path for short list input, see SMALL_INPUT. Every step gives
+# the same floats as the numpy functions it stands in for.
+
+
+def is_small_input(dates, values, labels):
+    """True for short lists or tuples of naive dates"""
+    if not all(isinstance(column, (list, tuple)) for column in (dates, values, labels)):
+        return False
+    # pandas.NaT is a datetime, but unlike dates not equal to itself
+    return 0 < len(dates) <= SMALL_INPUT and all(
+        isinstance(date, datetime.date)
+        and getattr(date, "tzinfo", None) is None
+        and date == date
+        for date in dates
+    )
+
+
+def pairwise_sum(values, start=0, stop=None):
+    """sum of a float list in the order numpy sums float64 arrays"""
+    if stop is None:
+        stop = len(values)
+    count = stop - start
+    if count < 8:
+        total = 0.0
+        for value in values[start:stop]:
+            total += value
+        return total
+    if count <= 128:
+        end = stop - count % 8
+        partial = values[start : start + 8]
+        for i in range(start + 8, end, 8):
+            partial = [a + b for a, b in zip(partial, values[i : i + 8])]
+        total = ((partial[0] + partial[1]) + (partial[2] + partial[3])) + (
+            (partial[4] + partial[5]) + (partial[6] + partial[7])
+        )
+        for value in values[end:stop]:
+            total += value
+        return total
+    half = count // 2
+    half -= half % 8
+    return pairwise_sum(values, start, start + half) + pairwise_sum(
+        values, start + half, stop
+    )
+
+
+def small_columns(dates, values, labels):
+    """as_columns of short list input: day ordinals, floats and labels as lists"""
+    ordinals = [date.toordinal() for date in dates]
+    values = [math.nan if value is None else float(value) for value in values]
+    labels = list(labels)
+    assert len(dates) and len(dates) == len(values) == len(labels)
+    return ordinals, values, labels
+
+
+def small_value_stats(values, outliers=True):
+    """get_value_stats of a float list"""
+    present = [i for i, value in enumerate(values) if not math.isnan(value)]
+    if not present:
+        raise ValueError("no values to scale")
+    data = [values[i] for i in present]
+    max_at = max(present, key=values.__getitem__)
+    min_at = min(present, key=values.__getitem__)
+    # stable, NaN last, like np.argsort(kind="stable")
+    order = sorted(range(len(values)), key=lambda i: (math.isnan(values[i]), values[i]))
+    mid_at = order[len(values) // 2]
+    total = pairwise_sum(data)
+    low = high = None
+    if outliers:
+        mean = total / len(data)
+        deviations = [value - mean for value in data]
+        std = math.sqrt(pairwise_sum([d * d for d in deviations]) / len(data))
+        kept = [value for value, d in zip(data, deviations) if abs(d) < 4 * std]
+        low, high = min(kept), max(kept)
+    return ValueStats(
+        len(data),
+        total,
+        values[min_at],
+        values[max_at],
+        min_at,
+        max_at,
+        mid_at,
+        low,
+        high,
+    )
+
+
+def small_scale(values, scaling="outliers", quantiles=QUANTILE_RANGE, value_stats=None):
+    """get_scale of a float list, for every scaling but the sketch"""
+    if not isinstance(scaling, str):
+        min_ret, max_ret = scaling
+        return float(min_ret), float(max_ret)
+    if scaling not in SCALINGS:
+        raise ValueError(f"unknown scaling {scaling!r}, expected one of {SCALINGS}")
+    data = [value for value in values if not math.isnan(value)]
+    if not data:
+        raise ValueError("no values to scale")
+    if scaling == "quantiles":
+        data.sort()
+        low, high = (data[quantile_rank(q, len(data))] for q in quantiles)
+        return low, high
+    if scaling == "range":
+        return min(data), max(data)
+    if value_stats is None or value_stats.low is None:
+        value_stats = small_value_stats(values)
+    return value_stats.low, value_stats.high
+
+
+def small_color_indices(values, palette_len, min_ret, max_ret):
+    """color_indices of a float list"""
+    overall_rng = get_distance(min_ret, max_ret) or 1.0
+    indices = []
+    for value in values:
+        if math.isnan(value):
+            indices.append(-1)
         else:
-            distance_min = get_distance(min_ret, elem) / overall_rng
-            if elem < min_ret:
-                distance_min = 0.0
-            colors_position = int(distance_min * palette_len)
-            if colors_position >= palette_len:
-                colors_position = palette_len - 1
+            position = max(value - min_ret, 0.0) / overall_rng * palette_len
+            indices.append(int(min(position, palette_len - 1)))
+    return indices
+
+
+def small_colorkey(colors, divisions, values, labels, value_stats=None):
+    """get_colorkey of a float list"""
+    if value_stats is None:
+        value_stats = small_value_stats(values, outliers=False)
+    assert value_stats.count < len(values) or value_stats.total
+    return colorkey_html(
+        colors,
+        divisions,
+        value_stats.max,
+        value_stats.min,
+        labels[value_stats.max_at],
+        labels[value_stats.mid_at],
+        labels[value_stats.min_at],
+    )
 
-            colors_dict[day] = {"color": palette[colors_position], "info": final_str}
-    return colors_dict
 
+class SmallColorData(ColorData):
+    """ColorData of small_columns lists"""
+
+    def __init__(self, ordinals, indices, labels, palette):
+        self.palette = palette
+        self.labels = labels
+        self.indices = indices
+        # later values for the same day win, as in ColorData
+        self.positions = {ordinal: i for i, ordinal in enumerate(ordinals)}
+
+    @functools.cached_property
+    def cell_labels(self):
+        return html_labels(self.labels)
+
+    def lookup(self, ordinals, css_classes=False):
+        fills = cell_fills(self.palette, css_classes)
+        cell_labels = self.cell_labels
+        cells, labels = [], []
+        for ordinal in ordinals:
+            position = self.positions.get(ordinal, -1)
+            if position < 0:
+                cells.append(fills[-1])
+                labels.append(None)
+            else:
+                cells.append(fills[self.indices[position]])
+                labels.append(cell_labels[position])
+        return cells, labels
+
+
+def small_colors_data(values, ordinals, palette, to_display, scale):
+    indices = small_color_indices(values, len(palette), *scale)
+    return SmallColorData(ordinals, indices, to_display, palette)
+
+
+def table_html(
+    dates,
+    values,
+    labels,
+    palette="RdYlGn",
+    css_classes=False,
+    json_payload=False,
+    stats=None,
+    scaling="outliers",
+    palette_size=None,
+):
+    """accepts columns of dates, values and labels.
+
+    dates may be a list of date/datetime objects, a datetime64 array or a
+    pandas Series/DatetimeIndex; values any float sequence or ndarray.
+    With css_classes cells reference palette classes from one stylesheet
+    instead of carrying inline colors, which makes pages much smaller.
+    json_payload writes bare year tables plus one compact data payload that
+    the page template script uses to color cells and fill tooltips.
+    A RenderStats passed as stats records the time of every stage.
+    scaling picks how the color scale is fitted to the values, see get_scale.
+    palette_size resamples the palette to that many colors, see get_palette.
+    """
+    chunks = iter_table_html(
+        dates,
+        values,
+        labels,
+        palette,
+        css_classes,
+        json_payload,
+        stats,
+        scaling,
+        palette_size,
+    )
+    return timed(stats, "table_html", "".join, chunks)
+
+
+def iter_table_html(
+    dates,
+    values,
+    labels,
+    palette="RdYlGn",
+    css_classes=False,
+    json_payload=False,
+    stats=None,
+    scaling="outliers",
+    palette_size=None,
+):
+    """yields the html of table_html in chunks of about one table row"""
+    colors = get_palette(palette, palette_size)
+    # the sketch is numpy code; small input gets the same scale from it
+    if json_payload or scaling == "sketch" or not is_small_input(dates, values, labels):
+        dates, values, labels = timed(
+            stats, "as_columns", as_columns, dates, values, labels
+        )
+        years = get_years(dates).tolist()
+
+        value_stats = timed(
+            stats, "value_stats", get_value_stats, values, scaling == "outliers"
+        )
+        colorkey = timed(
+            stats, "colorkey", get_colorkey, colors, 51, values, labels, value_stats
+        )
+        scale = timed(
+            stats, "scale", get_scale, values, scaling, value_stats=value_stats
+        )
+        color_object = timed(
+            stats, "colors", get_colors_data, values, dates, colors, labels, scale
+        )
+    else:
+        ordinals, values, labels = timed(
+            stats, "as_columns", small_columns, dates, values, labels
+        )
+        years = sorted({datetime.date.fromordinal(day).year for day in ordinals})
+        value_stats = timed(
+            stats, "value_stats", small_value_stats, values, scaling == "outliers"
+        )
+        colorkey = timed(
+            stats, "colorkey", small_colorkey, colors, 51, values, labels, value_stats
+        )
+        scale = timed(
+            stats, "scale", small_scale, values, scaling, value_stats=value_stats
+        )
+        color_object = timed(
+            stats, "colors", small_colors_data, values, ordinals, colors, labels, scale
+        )
+
+    def chunks():
+        _, layout_middle, layout_tail = LAYOUT_HTML.split("%s")
+        yield layout_head(colors, color_object, css_classes, json_payload)
+        for year in reversed(years):
+            if json_payload:
+                yield timed(stats, f"year_table {year}", year_table, year)
+            elif stats is not None:
+                # whole tables, so time spent by the consumer is not counted
+                yield timed(
+                    stats,
+                    f"year_table {year}",
+                    year_table,
+                    year,
+                    color_object=color_object,
+                    css_classes=css_classes,
+                )
+            else:
+                yield from iter_year_table(
+                    year, color_object=color_object, css_classes=css_classes
+                )
+        yield layout_middle
+        yield colorkey
+        yield layout_tail
 
-def table_html(dates, values, labels, palette="RdYlGn"):
-    colors = getattr(assets, palette)
+    return chunks()
 
-    """accepts tuple (datetime object, value)"""
-    assert dates[0].year
-    " ".join(labels)
-    max_value = np.nanmax(values)
-    min_value = np.nanmin(values)
-    year_dict = {}
-    special_dates = {}
 
-    for i, date in enumerate(dates):
-        year_dict[date.year] = 1
+class HeatCalendar:
+    """table_html state that re-renders only the years touched by new data.
+
+    html() returns the same markup as table_html over all data so far. After
+    append() only the years of the new dates are rendered again, unless the
+    color scale changed, which re-renders every year. With scaling="range"
+    the scale changes only when new values leave it.
+    """
 
-        if values[i] == max_value:
-            special_dates[date] = "max_value"
-        elif values[i] == min_value:
-            special_dates[date] = "min_value"
+    def __init__(
+        self,
+        dates,
+        values,
+        labels,
+        palette="RdYlGn",
+        css_classes=False,
+        json_payload=False,
+        scaling="outliers",
+        palette_size=None,
+    ):
+        self.colors = get_palette(palette, palette_size)
+        self.css_classes = css_classes
+        self.json_payload = json_payload
+        self.scaling = scaling
+        self.dates, self.values, self.labels = as_columns(dates, values, labels)
+        self.scale = None
+        self.tables = {}
+        self.update(get_years(self.dates))
+
+    def append(self, dates, values, labels):
+        """adds values; returns the years that were rendered again"""
+        import numpy as np
+
+        dates, values, labels = as_columns(dates, values, labels)
+        self.dates = np.concatenate((self.dates, dates))
+        self.values = np.concatenate((self.values, values))
+        self.labels = np.concatenate((self.labels, labels))
+        return self.update(get_years(dates))
+
+    def update(self, years):
+        value_stats = get_value_stats(self.values, self.scaling == "outliers")
+        scale = get_scale(self.values, self.scaling, value_stats=value_stats)
+        if scale != self.scale:
+            years = get_years(self.dates)
+        self.scale = scale
+        self.color_object = get_colors_data(
+            self.values, self.dates, self.colors, self.labels, scale=scale
+        )
+        self.colorkey = get_colorkey(
+            self.colors, 51, self.values, self.labels, value_stats
+        )
+        for year in years.tolist():
+            if self.json_payload:
+                table = year_table(year)
+            else:
+                table = year_table(
+                    year,
+                    color_object=self.color_object,
+                    css_classes=self.css_classes,
+                )
+            self.tables[year] = table
+        return years
+
+    def html(self):
+        _, layout_middle, layout_tail = LAYOUT_HTML.split("%s")
+        head = layout_head(
+            self.colors, self.color_object, self.css_classes, self.json_payload
+        )
+        tables = [self.tables[year] for year in sorted(self.tables, reverse=True)]
+        return head + "".join(tables) + layout_middle + self.colorkey + layout_tail
+
+
+def compress_chunks(chunks, encoding="gzip", level=None):
+    """yields bytes chunks compressed into one "gzip" or "br" stream.
+
+    level defaults to COMPRESSION_LEVELS. gzip output carries no timestamp,
+    so equal pages compress to equal bytes; "br" needs the brotli package.
+    """
+    if level is None:
+        level = COMPRESSION_LEVELS[encoding]
+    if encoding == "gzip":
+        import zlib
+
+        # wbits 31 writes a gzip header, with mtime 0
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == "br":
+        try:
+            import brotli
+        except ImportError:
+            raise ImportError("br compression needs brotli") from None
+        compressor = brotli.Compressor(quality=level)
+        process, finish = compressor.process, compressor.finish
+    else:
+        raise ValueError(f"unknown encoding {encoding!r}")
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
 
-    special_dates[dates[-1]] = "last_value"
 
-    colorkey = get_colorkey(colors, 51, values=values, labels=labels)
+def compress_page(data, encoding="gzip", level=None):
+    """data compressed for a Content-Encoding of "gzip" or "br", see compress_chunks"""
+    return b"".join(compress_chunks([data], encoding, level))
 
-    color_object = get_colors_data(values, dates, colors, to_display=labels)
 
-    table_list = []
-    for year in sorted(list(year_dict.keys()), reverse=True):
-        table = year_table(year, color_object=color_object)
-        table_list.append(table)
+def compressed_encoding(output):
+    """encoding of an output name ending in .gz or .br, else None"""
+    suffix = os.path.splitext(os.fspath(output))[1]
+    for encoding, encoding_suffix in COMPRESSION_SUFFIXES.items():
+        if suffix == encoding_suffix:
+            return encoding
+    return None
 
-    final_html = """
-        <table style="text-align: center;width:auto;" border="0"
-            cellpadding="0" cellspacing="0">
-            <tr>
-              <td id="heat_tables">%s</td>
-              <td id="color_wrap" style="vertical-align:top;padding:2.4rem 0px 0px 2rem;">%s</td>
-            </tr>
-        </table>""" % ("\n".join(table_list), colorkey)
-    return minify(final_html)
 
+def page_outputs(output, compress=None):
+    """(path, encoding) of every file a page is written to.
 
-def create_page(html, title, output="output.html", startfile=True):
+    the page goes to output (encoding None) plus output + ".gz" or ".br"
+    for each encoding in compress, one name or several. An output that
+    already ends in .gz or .br gets only the compressed page.
+    """
+    output = os.fspath(output)
+    encodings = (compress,) if isinstance(compress, str) else tuple(compress or ())
+    for encoding in encodings:
+        if encoding not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"unknown encoding {encoding!r}")
+    direct = compressed_encoding(output)
+    if direct:
+        return [(output, direct)]
+    return [(output, None)] + [
+        (output + COMPRESSION_SUFFIXES[encoding], encoding) for encoding in encodings
+    ]
+
+
+# numbers temporary file names apart between threads and calls
+TEMP_NUMBERS = itertools.count()
+
+
+def temp_path(path):
+    """a temporary file name next to path, unique to this process and call"""
+    return f"{path}.{os.getpid()}.{next(TEMP_NUMBERS)}.tmp"
+
+
+def write_file(path, chunks):
+    """writes bytes chunks to a temporary file that then replaces path.
+
+    a path hard linked to a RenderCache entry gets a new file instead of
+    being written through, which would change the cached page.
+    """
+    temp = temp_path(path)
+    # "x" fails rather than write through a file left at that name
+    f = open(temp, "xb")
+    try:
+        with f:
+            f.writelines(chunks)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def write_page(page, output, compress=None, level=None):
+    """writes page bytes to the page_outputs of output; returns their paths"""
+    paths = []
+    for path, encoding in page_outputs(output, compress):
+        if encoding is not None:
+            data = compress_page(page, encoding, level)
+        else:
+            data = page
+        write_file(path, [data])
+        paths.append(path)
+    return paths
+
+
+class PageRenderer:
+    """page template compiled once, rendered to strings, bytes or streams"""
+
+    def __init__(self, template_path=TEMPLATE_PATH, template_file=TEMPLATE_FILE):
+        from jinja2 import Environment, FileSystemLoader
+
+        env = Environment(loader=FileSystemLoader(template_path))
+        self.template = env.get_template(template_file)
+        source = env.loader.get_source(env, template_file)[0]
+        # identifies the template version in cache keys
+        self.template_hash = hashlib.sha256(source.encode("utf8")).hexdigest()
+
+    def render(self, html, title):
+        return self.template.render(
+            {
+                "title": title,
+                "chart_data": html,
+                # "square_size": f'{SQUARE_SIZE}px',
+            }
+        )
+
+    def render_bytes(self, html, title, encoding="utf8"):
+        return self.render(html, title).encode(encoding)
+
+    def stream(self, html_chunks, title, output, compress_level=None):
+        """renders the page around html chunks, e.g. from iter_table_html.
+
+        output is a file name or any writable text or binary object (open file,
+        gzip stream, socket file); the page is never built as a whole string.
+        A file name ending in .gz or .br is compressed while it is written.
+        """
+        page_chunks = self.template.generate(title=title, chart_chunks=html_chunks)
+        if isinstance(output, (str, os.PathLike)):
+            page_bytes = (chunk.encode("utf8") for chunk in page_chunks)
+            encoding = compressed_encoding(output)
+            if encoding:
+                page_bytes = compress_chunks(page_bytes, encoding, compress_level)
+            write_file(output, page_bytes)
+        elif isinstance(output, io.TextIOBase):
+            output.writelines(page_chunks)
+        else:
+            output.writelines(chunk.encode("utf8") for chunk in page_chunks)
+
+    def write(
+        self,
+        html,
+        title,
+        output="output.html",
+        startfile=False,
+        stats=None,
+        compress=None,
+        compress_level=None,
+    ):
+        """writes the page to output and the compressed copies of compress"""
+        page = timed(stats, "render", self.render_bytes, html, title)
+        start = time.perf_counter()
+        paths = write_page(page, output, compress, compress_level)
+        if stats is not None:
+            size = sum(os.path.getsize(path) for path in paths)
+            stats.record("write", time.perf_counter() - start, size)
+        if startfile and not compressed_encoding(output):
+            open_file(output)
+
+
+@functools.lru_cache(maxsize=None)
+def get_renderer():
+    """shared PageRenderer of the bundled template"""
+    return PageRenderer()
+
+
+def create_page(
+    html,
+    title,
+    output="output.html",
+    startfile=True,
+    stats=None,
+    compress=None,
+    compress_level=None,
+):
     assert "<table" in html
-    env = Environment(loader=FileSystemLoader(TEMPLATE_PATH))
-    template = env.get_template(TEMPLATE_FILE)
-    result = template.render(
-        {
-            "title": title,
-            "chart_data": html,
-            # "square_size": f'{SQUARE_SIZE}px',
-        }
+    get_renderer().write(
+        html, title, output, startfile, stats, compress, compress_level
+    )
+
+
+def panels_html(panels):
+    """lays out (title, table_html) panels in one grid.
+
+    style blocks repeated by the panels (color key, palette classes) are
+    written once at the top. Palette stylesheets all use the same selectors,
+    so with several palettes each one is limited to the panels using it.
+    """
+    palette_style = f'<style type="text/css">.cal_heat .{CSS_PREFIX}'
+    styles, panel_palettes, cells = {}, [], []
+    for title, html in panels:
+        blocks = STYLE_BLOCK.findall(html)
+        styles.update(dict.fromkeys(blocks))
+        palettes = [block for block in blocks if block.startswith(palette_style)]
+        panel_palettes.append(palettes[0] if palettes else None)
+        cells.append((title, STYLE_BLOCK.sub("", html)))
+    palettes = dict.fromkeys(block for block in panel_palettes if block)
+    scopes = {}
+    if len(palettes) > 1:
+        scopes = {block: f"heat_palette{i}" for i, block in enumerate(palettes)}
+    head = "".join(
+        (
+            block.replace(".cal_heat .", f".{scopes[block]} .cal_heat .")
+            if block in scopes
+            else block
+        )
+        for block in styles
+    )
+    body = []
+    for (title, html), palette in zip(cells, panel_palettes):
+        panel_class = "heat_panel"
+        if palette in scopes:
+            panel_class += " " + scopes[palette]
+        body.append(
+            f'<div class="pure-u-1 pure-u-xl-1-2 {panel_class}">'
+            f'<h3 class="panel_title">{title}</h3>{html}</div>'
+        )
+    return head + '<div class="pure-g">' + "".join(body) + "</div>"
+
+
+def create_multi_page(
+    panels,
+    title,
+    output="output.html",
+    startfile=True,
+    compress=None,
+    compress_level=None,
+):
+    """one page with a calendar per (title, table_html) panel"""
+    html = panels_html(panels)
+    assert "<table" in html
+    get_renderer().write(
+        html, title, output, startfile, compress=compress, compress_level=compress_level
+    )
+
+
+def stream_page(html_chunks, title, output="output.html", compress_level=None):
+    """renders the page around html chunks into a file name or writable object"""
+    get_renderer().stream(html_chunks, title, output, compress_level)
+
+
+def page_html(html, title):
+    """the page create_page writes, as a string"""
+    return get_renderer().render(html, title)
+
+
+def join_until(chunks, cancelled=None):
+    """joins chunks, stopping early once the threading.Event cancelled is set"""
+    if cancelled is None:
+        return "".join(chunks)
+    parts = []
+    for chunk in chunks:
+        if cancelled.is_set():
+            break
+        parts.append(chunk)
+    return "".join(parts)
+
+
+def calendar_page(dates, values, labels, title, cancelled=None, **table_options):
+    """page of a table_html calendar as a string.
+
+    setting the threading.Event cancelled stops the work after the current
+    table row and returns an incomplete result; AsyncRenderer does that when
+    its caller is cancelled.
+    """
+    stats = table_options.get("stats")
+    chunks = iter_table_html(dates, values, labels, **table_options)
+    html = timed(stats, "table_html", join_until, chunks, cancelled)
+    if cancelled is not None and cancelled.is_set():
+        return html
+    return timed(stats, "render", page_html, html, title)
+
+
+def input_hash(dates, values, labels, title="", **table_options):
+    """content hash of everything a rendered page depends on.
+
+    stats is left out, it does not change the page; the other table_options
+    must be JSON values.
+    """
+    import numpy as np
+
+    dates, values, labels = as_columns(dates, values, labels)
+    palette = table_options.get("palette", "RdYlGn")
+    palette_size = table_options.get("palette_size")
+    options = {key: value for key, value in table_options.items() if key != "stats"}
+    try:
+        options = json.dumps(options, sort_keys=True)
+    except TypeError as e:
+        raise TypeError(
+            f"table options must be JSON values to be hashed: {e}"
+        ) from None
+    digest = hashlib.sha256()
+    for part in (
+        str(CACHE_VERSION),
+        get_renderer().template_hash,
+        title,
+        options,
+        json.dumps(list(get_palette(palette, palette_size))),
+    ):
+        digest.update(part.encode("utf8") + b"\0")
+    digest.update(dates.astype(np.int64).tobytes())
+    digest.update(values.tobytes())
+    digest.update("\0".join(map(str, labels)).encode("utf8"))
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """rendered pages kept on disk under the hash of their inputs.
+
+    create_page skips rendering when the inputs were seen before and hard
+    links (or copies, across file systems) the cached page to output; an
+    output that already is that link is not written at all. The least
+    recently used pages are removed once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def create_page(
+        self,
+        dates,
+        values,
+        labels,
+        title,
+        output="output.html",
+        compress=None,
+        compress_level=None,
+        **table_options,
+    ):
+        """renders like table_html + create_page, returns True on a cache hit.
+
+        compressed copies (see create_page) are cached as well, per level.
+        """
+        key = input_hash(dates, values, labels, title, **table_options)
+        cached = os.path.join(self.directory, f"{key}.html")
+        hit = os.path.exists(cached)
+        stored = not hit
+        page = None
+        if hit:
+            os.utime(cached)
+        else:
+            html = table_html(dates, values, labels, **table_options)
+            page = timed(
+                table_options.get("stats"),
+                "render",
+                get_renderer().render_bytes,
+                html,
+                title,
+            )
+            self.store(cached, page)
+        for path, encoding in page_outputs(output, compress):
+            if encoding is None:
+                self.link(cached, path)
+                continue
+            level = (
+                COMPRESSION_LEVELS[encoding]
+                if compress_level is None
+                else compress_level
+            )
+            suffix = COMPRESSION_SUFFIXES[encoding]
+            variant = os.path.join(self.directory, f"{key}.{level}.html{suffix}")
+            if os.path.exists(variant):
+                os.utime(variant)
+            else:
+                if page is None:
+                    with open(cached, "rb") as f:
+                        page = f.read()
+                self.store(variant, compress_page(page, encoding, level))
+                stored = True
+            self.link(variant, path)
+        if stored:
+            self.evict()
+        return hit
+
+    def store(self, path, data):
+        write_file(path, [data])
+
+    def link(self, cached, output):
+        if os.path.exists(output) and os.path.samefile(cached, output):
+            return
+        temp = temp_path(output)
+        try:
+            os.link(cached, temp)
+        except OSError as e:
+            # another file system, or one without (more) hard links
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            with open(cached, "rb") as f:
+                write_file(output, iter(functools.partial(f.read, 2**20), b""))
+            return
+        try:
+            os.replace(temp, output)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".html", ".gz", ".br")):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+BatchResult = collections.namedtuple("BatchResult", "name output error")
+
+
+def pick_columns(names, date_column=None, value_column=None, label_column=None):
+    """positions of the date, value and label (or None) columns in names.
+
+    without column names the first column holds dates, the second values and
+    a third, if there is one, labels.
+    """
+    names = list(names)
+
+    def position(name, default):
+        if name is None:
+            return default
+        if name not in names:
+            raise ValueError(f"no column {name!r} in {names}")
+        return names.index(name)
+
+    default_label = None
+    if date_column is None and value_column is None and len(names) > 2:
+        default_label = 2
+    return (
+        position(date_column, 0),
+        position(value_column, 1),
+        position(label_column, default_label),
+    )
+
+
+def csv_batches(
+    path, date_column=None, value_column=None, label_column=None, batch_rows=65536
+):
+    """yields (dates, values, labels) arrays of batch_rows rows of a CSV file.
+
+    the file needs a header row; labels is None without a label column.
+    Empty values are NaN.
+    """
+    import csv
+
+    import numpy as np
+
+    with open(path, newline="", encoding="utf8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"{path} is empty")
+        date_at, value_at, label_at = pick_columns(
+            header, date_column, value_column, label_column
+        )
+        while True:
+            rows = list(itertools.islice(reader, batch_rows))
+            if not rows:
+                return
+            dates = np.array([row[date_at] for row in rows], dtype="datetime64")
+            values = np.array(
+                [float(row[value_at].strip() or "nan") for row in rows], np.float64
+            )
+            labels = None
+            if label_at is not None:
+                labels = np.array([row[label_at] for row in rows], dtype=object)
+            yield as_day_array(dates), values, labels
+
+
+def parquet_batches(
+    path, date_column=None, value_column=None, label_column=None, batch_rows=65536
+):
+    """yields (dates, values, labels) arrays of batch_rows rows of a Parquet
+    file, reading only those columns; needs pyarrow"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("reading Parquet files needs pyarrow") from None
+    import numpy as np
+
+    parquet_file = pq.ParquetFile(path)
+    names = parquet_file.schema_arrow.names
+    positions = pick_columns(names, date_column, value_column, label_column)
+    date_name, value_name, label_name = [
+        None if at is None else names[at] for at in positions
+    ]
+    columns = [name for name in (date_name, value_name, label_name) if name]
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+        dates = batch.column(date_name).to_numpy(zero_copy_only=False)
+        values = batch.column(value_name).to_numpy(zero_copy_only=False)
+        labels = None
+        if label_name:
+            labels = np.array(
+                [
+                    "" if label is None else str(label)
+                    for label in batch.column(label_name).to_pylist()
+                ],
+                dtype=object,
+            )
+        yield as_day_array(dates), values.astype(np.float64), labels
+
+
+def format_labels(values, label_format="%.2f"):
+    """values formatted with label_format, "n/d" for NaN"""
+    import numpy as np
+
+    return np.array(
+        [
+            "n/d" if math.isnan(value) else label_format % value
+            for value in values.tolist()
+        ],
+        dtype=object,
     )
-    with open(output, "w", encoding="utf8") as f:
-        f.write(result)
-    open_file(output)
+
+
+def arrow_columns(
+    table, date_column=None, value_column=None, label_column=None, label_format="%.2f"
+):
+    """(dates, values, labels) of a pyarrow Table or RecordBatch for table_html.
+
+    columns are picked like in read_columns. Dates and values share the Arrow
+    memory where the types allow it and labels stay an Arrow column.
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    date_at, value_at, label_at = pick_columns(
+        table.schema.names, date_column, value_column, label_column
+    )
+    dates = as_day_array(table.column(date_at))
+    values = arrow_to_numpy(table.column(value_at)).astype(np.float64, copy=False)
+    if label_at is None:
+        labels = format_labels(values, label_format)
+    else:
+        labels = table.column(label_at)
+        if not pa.types.is_string(labels.type):
+            labels = labels.cast(pa.string())
+    return dates, values, labels
+
+
+DailySeries = collections.namedtuple("DailySeries", "dates values labels")
+
+
+def aggregate_events(
+    timestamps,
+    weights=None,
+    groups=None,
+    how="count",
+    label_format="%g",
+    all_days=False,
+):
+    """daily values of raw events, as a DailySeries for table_html(*series).
+
+    timestamps take every form as_columns accepts for dates; each event
+    counts on its local calendar day and NaT is skipped. how="count" counts
+    events, "sum" and "mean" aggregate their weights, skipping NaN weights.
+    groups gives a key per event; then a dict of key -> DailySeries is
+    returned, in key order. One np.bincount over (group, day) slots does all
+    groups at once. Only days with events are returned; all_days fills the
+    days between the first and the last event with 0 (NaN for "mean").
+    Labels are the values formatted with label_format.
+    """
+    import numpy as np
+
+    if how not in AGGREGATIONS:
+        raise ValueError(f"unknown aggregation {how!r}, expected one of {AGGREGATIONS}")
+    days = as_day_array(timestamps)
+    keep = ~np.isnat(days)
+    if how != "count":
+        if weights is None:
+            raise ValueError(f"how={how!r} needs weights")
+        if is_arrow(weights):
+            weights = arrow_to_numpy(weights)
+        weights = np.asarray(weights, dtype=np.float64)
+        assert len(weights) == len(days)
+        keep &= ~np.isnan(weights)
+    offsets = days.astype(np.int64)
+    if groups is not None:
+        if is_arrow(groups):
+            groups = arrow_to_numpy(groups)
+        groups = np.asarray(groups)
+        assert len(groups) == len(days)
+    if not keep.all():
+        offsets = offsets[keep]
+        weights = None if how == "count" else weights[keep]
+        groups = None if groups is None else groups[keep]
+    if not len(offsets):
+        raise ValueError("no events to aggregate")
+
+    first = int(offsets.min())
+    offsets -= first
+    span = int(offsets.max()) + 1
+    if groups is None:
+        keys, slots = [None], offsets
+    else:
+        keys, codes = np.unique(groups, return_inverse=True)
+        keys = keys.tolist()
+        slots = codes.reshape(-1).astype(np.int64) * span + offsets
+    sparse = len(keys) * span > 4 * len(slots) + 2**20
+    if sparse:
+        # few events over many groups and days: bin only the used slots
+        used, slots = np.unique(slots, return_inverse=True)
+    counts = np.bincount(slots)
+    if how == "count":
+        totals = counts.astype(np.float64)
+    else:
+        totals = np.bincount(slots, weights=weights)
+    if not sparse:
+        used = np.flatnonzero(counts)
+        counts, totals = counts[used], totals[used]
+    if how == "mean":
+        totals /= counts
+
+    bounds = np.searchsorted(used, np.arange(len(keys) + 1) * span)
+    series = {}
+    for i, key in enumerate(keys):
+        start, stop = bounds[i], bounds[i + 1]
+        day_offsets = used[start:stop] - i * span
+        values = totals[start:stop]
+        if all_days:
+            filled = np.full(
+                int(day_offsets[-1] - day_offsets[0]) + 1,
+                math.nan if how == "mean" else 0.0,
+            )
+            filled[day_offsets - day_offsets[0]] = values
+            day_offsets = np.arange(day_offsets[0], day_offsets[-1] + 1)
+            values = filled
+        dates = (day_offsets + first).astype("datetime64[D]")
+        series[key] = DailySeries(dates, values, format_labels(values, label_format))
+    return series if groups is not None else series[None]
+
+
+def read_columns(
+    path,
+    date_column=None,
+    value_column=None,
+    label_column=None,
+    label_format="%.2f",
+    batch_rows=65536,
+):
+    """(dates, values, labels) arrays of a CSV or Parquet file.
+
+    the file is read batch_rows rows at a time, so no whole data frame is
+    built. Without a label column values are formatted with label_format,
+    "n/d" for missing values.
+    """
+    import numpy as np
+
+    if path.lower().endswith((".parquet", ".pq")):
+        batches = parquet_batches
+    else:
+        batches = csv_batches
+    dates, values, labels = [], [], []
+    for batch_dates, batch_values, batch_labels in batches(
+        path, date_column, value_column, label_column, batch_rows
+    ):
+        if batch_labels is None:
+            batch_labels = format_labels(batch_values, label_format)
+        dates.append(batch_dates)
+        values.append(batch_values)
+        labels.append(batch_labels)
+    if not dates:
+        raise ValueError(f"{path} has no rows")
+    return np.concatenate(dates), np.concatenate(values), np.concatenate(labels)
+
+
+def render_job(
+    job,
+    output_dir=".",
+    table_options=None,
+    cache=None,
+    compress=None,
+    compress_level=None,
+):
+    """renders one (name, dates, values, labels) job to output_dir/name.html"""
+    name, dates, values, labels = job
+    table_options = table_options or {}
+    try:
+        output = os.path.join(output_dir, f"{name}.html")
+        if cache is not None:
+            cache.create_page(
+                dates,
+                values,
+                labels,
+                name,
+                output,
+                compress,
+                compress_level,
+                **table_options,
+            )
+        else:
+            html = table_html(dates, values, labels, **table_options)
+            get_renderer().write(
+                html,
+                title=name,
+                output=output,
+                stats=table_options.get("stats"),
+                compress=compress,
+                compress_level=compress_level,
+            )
+        return BatchResult(name, output, None)
+    except Exception as e:
+        return BatchResult(name, None, f"{type(e).__name__}: {e}")
+
+
+def file_page_name(path):
+    """name of the page of an input file: its file name without extension"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def render_file_job(
+    path,
+    output_dir=".",
+    read_options=None,
+    table_options=None,
+    cache=None,
+    compress=None,
+    compress_level=None,
+):
+    """reads path with read_columns and renders it like render_job, named
+    after the file"""
+    name = file_page_name(path)
+    try:
+        columns = read_columns(path, **(read_options or {}))
+    except Exception as e:
+        return BatchResult(name, None, f"{type(e).__name__}: {e}")
+    return render_job(
+        (name, *columns), output_dir, table_options, cache, compress, compress_level
+    )
+
+
+def run_chunk(worker, chunk):
+    """worker over a list of jobs, in a pool process"""
+    return [worker(job) for job in chunk]
+
+
+def map_jobs(worker, jobs, workers=None, chunksize=8, progress=None):
+    """results of worker over jobs in job order, from a process pool unless
+    workers is 1; progress(done, result) is called as jobs finish.
+
+    jobs are read lazily: at most two chunks of chunksize jobs per worker are
+    in flight, so a generator of jobs is never held in memory as a whole.
+    """
+    results = []
+    if workers == 1:
+        for result in map(worker, jobs):
+            results.append(result)
+            if progress:
+                progress(len(results), result)
+        return results
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    workers = workers or os.cpu_count() or 1
+    jobs = iter(jobs)
+    chunks = iter(lambda: list(itertools.islice(jobs, chunksize)), [])
+    # results of each chunk by the index of its first job
+    chunk_results, pending, submitted = {}, {}, 0
+    # the initializer compiles the page template once per worker process
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_renderer) as executor:
+        while True:
+            for chunk in itertools.islice(chunks, 2 * workers - len(pending)):
+                pending[executor.submit(run_chunk, worker, chunk)] = submitted
+                submitted += len(chunk)
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = chunk_results[pending.pop(future)] = future.result()
+                for result in chunk:
+                    results.append(result)
+                    if progress:
+                        progress(len(results), result)
+    return [
+        result for start in sorted(chunk_results) for result in chunk_results[start]
+    ]
+
+
+def render_batch(
+    jobs,
+    output_dir=".",
+    workers=None,
+    chunksize=8,
+    progress=None,
+    cache=None,
+    compress=None,
+    compress_level=None,
+    **table_options,
+):
+    """renders (name, dates, values, labels) jobs in a process pool.
+
+    returns one BatchResult per job, in job order; a failed job has output
+    None and the error message. progress(done, result) is called as jobs
+    finish. With a RenderCache unchanged jobs are not rendered again.
+    compress and compress_level work as in create_page. table_options are
+    passed to table_html.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    worker = functools.partial(
+        render_job,
+        output_dir=output_dir,
+        table_options=table_options,
+        cache=cache,
+        compress=compress,
+        compress_level=compress_level,
+    )
+    return map_jobs(worker, jobs, workers, chunksize, progress)
+
+
+def render_files(
+    paths,
+    output_dir=".",
+    workers=None,
+    progress=None,
+    cache=None,
+    date_column=None,
+    value_column=None,
+    label_column=None,
+    label_format="%.2f",
+    batch_rows=65536,
+    compress=None,
+    compress_level=None,
+    **table_options,
+):
+    """renders CSV or Parquet files to output_dir/<file name>.html.
+
+    like render_batch, but every worker reads its files itself with
+    read_columns, so the data never passes through the calling process.
+    Raises ValueError, before rendering anything, when two files would
+    write the same page, e.g. x.csv and x.parquet.
+    """
+    paths = list(paths)
+    names = collections.defaultdict(list)
+    for path in paths:
+        names[os.path.normcase(file_page_name(path))].append(os.fspath(path))
+    clashes = [same for same in names.values() if len(same) > 1]
+    if clashes:
+        raise ValueError(
+            "files with the same page name: "
+            + "; ".join(", ".join(same) for same in clashes)
+        )
+    os.makedirs(output_dir, exist_ok=True)
+    read_options = {
+        "date_column": date_column,
+        "value_column": value_column,
+        "label_column": label_column,
+        "label_format": label_format,
+        "batch_rows": batch_rows,
+    }
+    worker = functools.partial(
+        render_file_job,
+        output_dir=output_dir,
+        read_options=read_options,
+        table_options=table_options,
+        cache=cache,
+        compress=compress,
+        compress_level=compress_level,
+    )
+    return map_jobs(worker, paths, workers, 1, progress)
+
+
+class AsyncRenderer:
+    """renders calendars for asyncio code without blocking the event loop.
+
+    the work runs in executor, by default a thread pool of max_concurrency
+    threads; a ProcessPoolExecutor also works, but then stats are not
+    recorded. At most max_concurrency calls run at once and later ones wait
+    for a free slot. A cancelled call gives up its queued job, or stops a
+    running thread job after its current table row; it keeps its slot until
+    the job is done, so cancelled work never exceeds the limit.
+
+        renderer = AsyncRenderer(max_concurrency=8)
+        page = await renderer.calendar_page(dates, values, labels, "Sales")
+    """
+
+    def __init__(self, executor=None, max_concurrency=4):
+        self.executor = executor
+        self.own_executor = executor is None
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+
+    def get_executor(self):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.executor = ThreadPoolExecutor(
+                self.max_concurrency, thread_name_prefix="tabheatcal"
+            )
+        return self.executor
+
+    @property
+    def uses_processes(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        return isinstance(self.executor, ProcessPoolExecutor)
+
+    async def run(self, func, *args, cancelled=None, **kwargs):
+        """awaits func(*args, **kwargs) in the executor within the limit.
+
+        a threading.Event passed as cancelled is set when the call is
+        cancelled, for func to stop early.
+        """
+        import asyncio
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            future = self.get_executor().submit(func, *args, **kwargs)
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                if cancelled is not None:
+                    cancelled.set()
+                if not future.cancel():
+                    # hold the slot until the running job has stopped
+                    done = asyncio.wrap_future(future)
+                    await asyncio.wait([done])
+                    if not done.cancelled():
+                        done.exception()
+                raise
+
+    async def table_html(self, dates, values, labels, **table_options):
+        """table_html in the executor"""
+        if self.uses_processes:
+            return await self.run(table_html, dates, values, labels, **table_options)
+        import threading
+
+        cancelled = threading.Event()
+
+        def render():
+            chunks = iter_table_html(dates, values, labels, **table_options)
+            stats = table_options.get("stats")
+            return timed(stats, "table_html", join_until, chunks, cancelled)
+
+        return await self.run(render, cancelled=cancelled)
+
+    async def calendar_page(self, dates, values, labels, title, **table_options):
+        """calendar_page in the executor"""
+        if self.uses_processes:
+            return await self.run(
+                calendar_page, dates, values, labels, title, **table_options
+            )
+        import threading
+
+        cancelled = threading.Event()
+        render = functools.partial(
+            calendar_page, dates, values, labels, title, cancelled, **table_options
+        )
+        return await self.run(render, cancelled=cancelled)
+
+    async def page_html(self, html, title):
+        """page_html in the executor"""
+        return await self.run(page_html, html, title)
+
+    async def create_page(
+        self,
+        html,
+        title,
+        output="output.html",
+        startfile=False,
+        stats=None,
+        compress=None,
+        compress_level=None,
+    ):
+        """create_page in the executor, which also writes the files"""
+        await self.run(
+            create_page,
+            html,
+            title,
+            output,
+            startfile,
+            stats,
+            compress,
+            compress_level,
+        )
+
+    async def render_job(
+        self,
+        job,
+        output_dir=".",
+        cache=None,
+        compress=None,
+        compress_level=None,
+        **table_options,
+    ):
+        """render_job of one (name, dates, values, labels) job in the executor"""
+        return await self.run(
+            render_job, job, output_dir, table_options, cache, compress, compress_level
+        )
+
+    def close(self, wait=True):
+        """shuts down the executor if the renderer created it"""
+        if self.own_executor and self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close(wait=False)
+
+
+def available_encodings():
+    """encodings compress_page can produce here, most preferred first"""
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return ("gzip",)
+    return tuple(COMPRESSION_LEVELS)
+
+
+def pick_encoding(accept_encoding, encodings):
+    """first of encodings an Accept-Encoding header allows, else identity"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+class PageLRU:
+    """rendered pages in memory; the least recently used go beyond max_bytes.
+
+    an entry maps a content encoding to the body of one input hash.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        import threading
+
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, encoding):
+        """body of key in encoding, or None"""
+        with self.lock:
+            bodies = self.entries.get(key)
+            if bodies is None or encoding not in bodies:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return bodies[encoding]
+
+    def put(self, key, encoding, body):
+        with self.lock:
+            bodies = self.entries.setdefault(key, {})
+            self.entries.move_to_end(key)
+            self.size += len(body) - len(bodies.get(encoding, b""))
+            bodies[encoding] = body
+            while self.size > self.max_bytes and self.entries:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= sum(map(len, dropped.values()))
+
+
+class CalendarApp:
+    """WSGI app serving calendar pages on demand; .asgi is the ASGI app.
+
+    load(name) returns the (dates, values, labels) shown at /name, or None
+    for 404; for .asgi it may also be a coroutine function. title(name) gives
+    the page title as plain text; it is HTML-escaped. The query
+    parameters of QUERY_OPTIONS override table_options. Pages are kept in a
+    PageLRU under their input_hash and compressed once per content encoding,
+    so a calendar is rendered again only when its data or options change. A
+    strong ETag of that hash answers a matching If-None-Match with 304 Not
+    Modified, without rendering. In .asgi hashing and rendering run in an
+    AsyncRenderer of max_concurrency threads.
+
+        app = CalendarApp(load_sales, css_classes=True)
+        asgi_app = app.asgi
+    """
+
+    def __init__(
+        self,
+        load,
+        title=None,
+        max_bytes=64 * 2**20,
+        cache_control="no-cache",
+        max_concurrency=4,
+        **table_options,
+    ):
+        self.load = load
+        self.title = title or (lambda name: name)
+        self.pages = PageLRU(max_bytes)
+        self.cache_control = cache_control
+        self.table_options = table_options
+        self.encodings = available_encodings()
+        self.renderer = AsyncRenderer(max_concurrency=max_concurrency)
+
+    def request_options(self, method, query_string):
+        """(table options, None) of a request, or (None, error response)"""
+        from urllib.parse import parse_qsl
+
+        if method not in ("GET", "HEAD"):
+            return None, (405, [("Allow", "GET, HEAD")], b"")
+        options = dict(self.table_options)
+        for key, value in parse_qsl(query_string):
+            if key not in QUERY_OPTIONS:
+                continue
+            if key in ("css_classes", "json_payload"):
+                if value.lower() not in ("1", "true", "0", "false"):
+                    return None, self.error(400, f"{key} must be true or false")
+                value = value.lower() in ("1", "true")
+            elif key == "scaling" and value not in SCALINGS:
+                return None, self.error(400, f"scaling must be one of {SCALINGS}")
+            elif key == "palette" and value not in palette_names():
+                return None, self.error(400, f"unknown palette {value}")
+            options[key] = value
+        return options, None
+
+    def error(self, status, message=None):
+        from http import HTTPStatus
+
+        body = (message or HTTPStatus(status).phrase).encode("utf8")
+        return status, [("Content-Type", "text/plain; charset=utf-8")], body
+
+    def page_response(self, name, data, options, accept_encoding, if_none_match):
+        """(status, headers, body) of the page of data, rendered if not cached"""
+        if data is None:
+            return self.error(404)
+        from html import escape
+
+        dates, values, labels = data
+        # the name comes from the url, the page template does not escape
+        title = escape(self.title(name))
+        key = input_hash(dates, values, labels, title, **options)
+        encoding = pick_encoding(accept_encoding, self.encodings)
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        etag = f'"{key}{suffix}"'
+        headers = [("ETag", etag), ("Vary", "Accept-Encoding")]
+        if self.cache_control:
+            headers.append(("Cache-Control", self.cache_control))
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return 304, headers, b""
+
+        body = self.pages.get(key, encoding)
+        if body is None:
+            page = None
+            if encoding != "identity":
+                page = self.pages.get(key, "identity")
+            if page is None:
+                page = calendar_page(dates, values, labels, title, **options)
+                page = page.encode("utf8")
+                self.pages.put(key, "identity", page)
+            body = page if encoding == "identity" else compress_page(page, encoding)
+            self.pages.put(key, encoding, body)
+        headers.append(("Content-Type", "text/html; charset=utf-8"))
+        headers.append(("Content-Length", str(len(body))))
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        return 200, headers, body
+
+    def __call__(self, environ, start_response):
+        from http import HTTPStatus
+
+        method = environ.get("REQUEST_METHOD", "GET")
+        options, error = self.request_options(method, environ.get("QUERY_STRING", ""))
+        if error:
+            status, headers, body = error
+        else:
+            name = environ.get("PATH_INFO", "").strip("/")
+            status, headers, body = self.page_response(
+                name,
+                self.load(name),
+                options,
+                environ.get("HTTP_ACCEPT_ENCODING", ""),
+                environ.get("HTTP_IF_NONE_MATCH", ""),
+            )
+        start_response(f"{status} {HTTPStatus(status).phrase}", headers)
+        return [b"" if method == "HEAD" else body]
+
+    async def asgi(self, scope, receive, send):
+        import inspect
+
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                else:
+                    self.renderer.close(wait=False)
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        headers = {
+            key.decode("latin-1").lower(): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+        method = scope["method"]
+        query_string = scope["query_string"].decode("latin-1")
+        options, error = self.request_options(method, query_string)
+        if error:
+            status, response_headers, body = error
+        else:
+            name = scope["path"].strip("/")
+            if inspect.iscoroutinefunction(self.load):
+                data = await self.load(name)
+            else:
+                data = await self.renderer.run(self.load, name)
+            status, response_headers, body = await self.renderer.run(
+                self.page_response,
+                name,
+                data,
+                options,
+                headers.get("accept-encoding", ""),
+                headers.get("if-none-match", ""),
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (key.lower().encode("latin-1"), value.encode("latin-1"))
+                    for key, value in response_headers
+                ],
+            }
+        )
+        await send(
+            {"type": "http.response.body", "body": b"" if method == "HEAD" else body}
+        )
 
 
 def test_heatmap():
@@ -429,6 +2698,7 @@ def test_heatmap():
 def demo():
     from datetime import datetime, timedelta
 
+    import numpy as np
     import pandas as pd
 
     np.random.seed(42)
@@ -459,10 +2729,8 @@ def demo():
 
     df = pd.DataFrame({"random_values": random_data}, index=time_index)
 
-    dates = [pd.to_datetime(date).date() for date in df.index.values]
-    values = df.random_values.values.tolist()
     labels = df.random_values.map(lambda x: "%.2f%%" % x).values
-    html = table_html(dates, values, labels)
+    html = table_html(df.index, df.random_values, labels)
     create_page(
         html,
         title="Example random data",